@@ -0,0 +1,119 @@
+'''Reading and writing ARFF data rows, dense or sparse ({index value, ...}).'''
+import csv
+
+
+def read_header(data_file):
+    '''Header lines of an ARFF file, up to and including the @data line.'''
+    header = []
+    for line in data_file:
+        header.append(line)
+        if line.strip().lower().startswith('@data'):
+            break
+    return header
+
+
+def attribute_name(line):
+    '''Name of the attribute declared by an @attribute line.'''
+    declaration = line.strip()[len('@attribute'):].strip()
+    if declaration[:1] in ('"', "'"):
+        return declaration[1:declaration.index(declaration[0], 1)]
+    return declaration.split()[0]
+
+
+def attribute_defaults(header):
+    '''Value of every attribute left out of a sparse row: 0, or the first
+    declared value of a nominal attribute.'''
+    defaults = []
+    for line in header:
+        line = line.strip()
+        if not line.lower().startswith('@attribute'):
+            continue
+        if line.endswith('}') and '{' in line:
+            values = next(csv.reader([line[line.index('{') + 1:-1]], skipinitialspace=True))
+            defaults.append(values[0].strip().strip('\'"') if values else '0')
+        else:
+            defaults.append('0')
+    return defaults
+
+
+def expand(line, defaults):
+    '''Values of the sparse row ``line`` for every attribute.'''
+    values = list(defaults)
+    for index, value in sparse_cells(line):
+        values[index] = value
+    return values
+
+
+def sparse_cells(line):
+    '''(index, value) pairs of the sparse row ``line``. Quoted values are
+    read back as ``sparse_value`` writes them: in single or double quotes,
+    with backslash escapes.'''
+    cells = []
+    line = line.strip()
+    end = len(line) - 1 if line.endswith('}') else len(line)
+    i = 1
+    while i < end:
+        while i < end and line[i] in ', \t':
+            i += 1
+        if i == end:
+            break
+        start = i
+        while i < end and not line[i].isspace():
+            i += 1
+        index = int(line[start:i])
+        while i < end and line[i] in ' \t':
+            i += 1
+        if i < end and line[i] in '\'"':
+            quote, chars = line[i], []
+            i += 1
+            while i < end and line[i] != quote:
+                if line[i] == '\\' and i + 1 < end:
+                    i += 1
+                chars.append(line[i])
+                i += 1
+            value = ''.join(chars)
+            i += 1
+        else:
+            start = i
+            while i < end and line[i] != ',':
+                i += 1
+            value = line[start:i].strip()
+        cells.append((index, value))
+    return cells
+
+
+def data_rows(data_file, header=None):
+    '''Rows of ``data_file`` read by csv.reader. With the ARFF ``header``
+    (``read_header`` of the same file) empty rows and comments are skipped
+    and sparse rows are expanded.'''
+    if header is None:
+        return csv.reader(data_file)
+    return _arff_rows(data_file, attribute_defaults(header))
+
+
+def _arff_rows(data_file, defaults):
+    # one reader for the dense rows, fed a line at a time
+    dense = [None]
+    reader = csv.reader(iter(lambda: dense[0], None))
+    for line in data_file:
+        stripped = line.strip()
+        if not stripped or stripped.startswith('%'):
+            continue
+        if stripped.startswith('{'):
+            yield expand(stripped, defaults)
+        else:
+            dense[0] = line
+            yield next(reader)
+
+
+def sparse_value(value):
+    '''ARFF representation of a value, quoted if needed.'''
+    value = value.strip()
+    if not value or any(c in value for c in ' ,{}\'"%\t'):
+        return "'%s'" % value.replace('\\', '\\\\').replace("'", "\\'")
+    return value
+
+
+def sparse_row(values):
+    '''Sparse ARFF row of {index: value} pairs.'''
+    return '{%s}\n' % ', '.join('%d %s' % (index, sparse_value(values[index])) for index in sorted(values))
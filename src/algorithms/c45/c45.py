@@ -1,36 +1,51 @@
 # coding: utf-8
 #! usr/bin/python
 
+import csv
+import os
+from collections import Counter
+from copy import copy
+from itertools import islice
 from math import log, sqrt
+import numpy as np
 import scipy.stats
 from sm_utils import printTree
+from flat import compileTree
 from optparse import OptionParser
-from tools import readData, writeData
+from tools import readMatrix, readArff, arffAttributes, nominalAttributes, encodeRows
+from algorithms import shared
+from algorithms.arff_data import read_header, data_rows
 
 class AttBestDetails:
     ''' For the best known gain on an attribute, stores associated split details '''
     cut = None
     gain = None
     splitInfo = None
+    subset = None   # categories of a nominal attribute going left, instead of cut
 
-    def __init__(self, cut, gain, splitInfo):
+    def __init__(self, cut, gain, splitInfo, subset=None):
         self.cut = cut
         self.gain = gain
         self.splitInfo = splitInfo
+        self.subset = subset
 
     def printDetails(self, att):
         print 'att: %d, cut: %f, gain: %f, splitInfo: %f' % (att, self.cut, self.gain, self.splitInfo)
 
 class Test:
-    ''' testedAtt <= cut '''
+    ''' testedAtt <= cut, or testedAtt in subset for a nominal attribute '''
     testedAtt = None
     cut = None
+    subset = None   # sorted category indices, None for a continuous attribute
 
-    def __init__(self, testedAtt, cut):
+    def __init__(self, testedAtt, cut, subset=None):
         self.testedAtt = testedAtt
         self.cut = cut
+        self.subset = subset
 
     def isValid(self, vector):
+        if self.subset is not None:
+            return vector[self.testedAtt] in self.subset
         if vector[self.testedAtt] <= self.cut:
             return True
         return False
@@ -66,74 +81,120 @@ class Tree:
                 leaf_count += branch.countLeaves()
             return leaf_count
 
+def quantileBins(X, bins=256):
+    ''' Quantises every column of X into at most bins (<= 256) quantile bins.
+        A column with no more than bins distinct values gets a bin per value.
+        returns: uint8 codes of X and, for every column, cut values: the
+                 largest value of each bin but the last '''
+    if not 2 <= bins <= 256:
+        raise ValueError('bins must be from 2 to 256, got %r' % (bins,))
+    n, p = X.shape
+    codes = np.empty((n, p), dtype=np.uint8)
+    cuts = []
+    for att in range(p):
+        values = np.sort(X[:, att])
+        distinct = np.unique(values)
+        if len(distinct) > bins:
+            distinct = np.unique(values[(np.arange(1, bins) * n) // bins - 1])
+            distinct = np.append(distinct[distinct < values[-1]], values[-1])
+        attCuts = distinct[:-1]
+        codes[:, att] = np.searchsorted(attCuts, X[:, att], side='left')
+        cuts.append(attCuts)
+    return codes, cuts
+
 class C45:
 
     learnData = None # learning data to build the tree from
+    X = None        # learning vectors, a float matrix
+    y = None        # class of each learning vector, an index into classes
+    classes = None  # class values, sorted
     nClasses = None # total number of classes
     costs = None    # cost matrix C(actual, predicted)
     priorCorrection = None  # use prior probabilities correction according to cost matrix
+    costVector = None       # cost of misclassifying a vector of each class, in classes order
+    predictionCosts = None  # cost of predicting each class, in classes order
+    bins = None     # number of quantile bins per attribute for split search, exact search if not set
+    codes = None    # bin of every learning vector value
+    binCuts = None  # cut value after each bin, for every attribute
+    blockSize = 65536 # vectors counted into histograms at a time
+    nWorkers = None     # processes constructing the tree, one if not set
+    subtreeSize = 5000  # subtrees with at most this many vectors are constructed by one worker
+    attributes = None   # attributes allowed in tests, all if not set
+    nominal = None      # declared values of nominal attributes, {attribute: values}
 
-    def __init__(self, learnData, costs=None, priorCorrection=None):
+    def __init__(self, learnData, costs=None, priorCorrection=None, y=None, bins=None, nWorkers=None,
+                 nominal=None):
+        ''' learnData: vectors with the class in the last column, or a matrix
+            of attributes when the int class vector y is given
+            bins: search splits among at most bins (2 to 256) quantile cuts
+                  of every attribute instead of all distinct values
+            nWorkers: construct the tree in a pool of nWorkers processes
+            nominal: {attribute: declared values} of nominal attributes, whose
+                     values in learnData are indices of the declared values,
+                     e. g. from tools.readArff '''
+        if bins and not 2 <= bins <= 256:
+            raise ValueError('bins must be from 2 to 256, got %r' % (bins,))
+        if y is None:
+            X = np.array([row[:-1] for row in learnData], dtype=float)
+            y = [row[-1] for row in learnData]
+        else:
+            X = np.asarray(learnData, dtype=float)
         self.learnData = learnData
-        self.nClasses=len(self.classDistribution(learnData).keys())
+        self.X = X
+        classes, self.y = np.unique(y, return_inverse=True)
+        self.classes = classes.tolist()
+        self.nClasses = len(self.classes)
         self.costs = costs
         self.priorCorrection = priorCorrection
+        self.bins = bins
+        self.nWorkers = nWorkers
+        self.nominal = nominal or {}
+        if bins:
+            self.codes, self.binCuts = quantileBins(self.X, bins)
 
-    def sortByAtt(self, att, data):
-        return sorted(data, key = lambda data_entry: data_entry[att])
+    def prepareCosts(self):
+        ''' Sums rows and columns of the cost matrix once per tree '''
+        self.costVector = None
+        self.predictionCosts = None
+        if self.priorCorrection:
+            # costVectors[actual]: cost of misclassifying a vector of class actual
+            costVectors = [sum(self.costs[actual][predicted] for predicted in range(self.nClasses)) for actual in range(self.nClasses)]
+            self.costVector = np.array([costVectors[c] for c in self.classes])
+            self.predictionCosts = np.array([sum(self.costs[actual][c] for actual in range(self.nClasses)) for c in self.classes])
 
-    def classDistribution(self, data):
-        ''' Counts vectors in each class '''
-        counts = {}
-        for row in data:
-            c = row[-1]
-            if c not in counts.keys():
-                counts[c]=1
-            else:
-                n = counts[c]
-                counts[c] = n + 1
-        return counts
-    
-    def classProbabilities(self, data):
-        ''' Determines a proportion of each class vectors in data '''
-        counts = self.classDistribution(data)
-        for c in counts.keys():
-            counts[c] = float(counts[c])/len(data)
-        return counts
-    
-    def costSensitiveClassProbabilities(self, data):
-        ''' Altered prior class probabilities according to cost-matrix '''
-        # costVectors[actual]: cost of misclassifying a vector of class actual
-        costVectors = [sum(self.costs[actual][predicted] for predicted in range(self.nClasses)) for actual in range(self.nClasses)]
-        counts = self.classDistribution(data)
-        costSum = 0
-        for c in counts.keys():
-            counts[c] *= costVectors[c]
-            costSum += counts[c]
-        for c in counts.keys():
-            counts[c] = float(counts[c]) / costSum
-        return counts
-    
-    def setInfo(self, data):
-        ''' Returns info(S) '''
+    def classCounts(self, data):
+        ''' Counts vectors in each class, data: indices of learning vectors '''
+        return np.bincount(self.y[data], minlength=self.nClasses)
+
+    def classDistribution(self, counts):
+        ''' Class distribution dict for class counts, only present classes are included '''
+        return dict((self.classes[i], int(counts[i])) for i in np.flatnonzero(counts))
+
+    def entropy(self, counts, n):
+        ''' Returns info(S) for class counts of S. counts can also be a matrix
+            with one set per row, n then is a vector of set sizes. With prior
+            correction class probabilities are altered according to the cost matrix '''
+        counts = np.asarray(counts)
         if self.priorCorrection:
-            return -sum([p * log(p,2) for p in self.costSensitiveClassProbabilities(data).values()])
+            weighted = counts * self.costVector
+            p = weighted / np.expand_dims(weighted.sum(axis=-1), -1).astype(float)
         else:
-            return -sum([p * log(p,2) for p in self.classProbabilities(data).values()])
-    
-    def testInfo(self, X, left, right):
-        ''' Returns infoX(S) '''
-        n = len(left) + len(right)
-        infoLeft = self.setInfo(left)
-        infoRight = self.setInfo(right)
-        return float(len(left))/n * infoLeft + float(len(right))/n * infoRight, infoLeft, infoRight
-    
-    def splitInfo(self, left, right):
-        ''' Returns splitInfo(X) '''
-        n = len(left) + len(right)
-        return -sum([float(len(s))/n * log(float(len(s))/n,2)  for s in [left, right]])
-    
-    
+            p = counts / np.expand_dims(np.asarray(n, dtype=float), -1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            terms = np.where(counts > 0, p * (np.log(p) / log(2)), 0.0)
+        return -terms.sum(axis=-1)
+
+    def bestClassFromCounts(self, counts):
+        ''' Selects the best class with respect to cost matrix for class counts
+            returns: best class value and its cost '''
+        if self.priorCorrection:
+            costs = np.where(counts > 0, self.predictionCosts, np.inf)
+            best = np.argmin(costs)
+        else:
+            costs = counts.sum() - counts
+            best = np.argmax(counts)
+        return self.classes[best], costs[best]
+
     def bestClassFromClassDist(self, counts):
         bestClass = None
         minCost = None
@@ -147,44 +208,148 @@ class C45:
                 bestClass = c
                 minCost = cost
         return bestClass, minCost, counts
-    
-    def bestClassFromData(self, data):
-        ''' Selects the best class with respect to cost matrix for this data set'''
-        counts = self.classDistribution(data)
-        return self.bestClassFromClassDist(counts)
-    
-    def splitData(self, test, data):
-        ''' Returns left and right subsets, as determined by the provided test '''
-        left = []
-        right = []
-        for row in data:
-            if row[test.testedAtt] <= test.cut:
-                left.append(row)
-            else:
-                right.append(row)
-        return left, right
-    
-    def constructTree(self, data=None, info=None):
-        ''' Constructs a continuous-valued decision tree using the C4.5 algorithm '''
-        if data is None:
-            data = self.learnData
 
-        if info is None:
-            info = self.setInfo(data)
-    
-        # make a leaf first, then see if try branching
+    def bestCut(self, att, data, info, minSplit):
+        ''' Finds the cut of att with the best gain. Vectors are sorted by
+            att once, class counts left of every cut are cumulative sums of
+            the sorted classes, gain and splitInfo of all cuts are computed
+            from them at once. Among cuts with equal gain the one whose value
+            comes first in data is chosen.
+            returns: AttBestDetails or None if no cut leaves minSplit vectors
+                     on both sides'''
+        n = len(data)
+        values = self.X[data, att]
+        order = np.argsort(values, kind='mergesort') # stable: equal values keep data order
+        values = values[order]
+        ends = np.flatnonzero(values[1:] != values[:-1]) # last vector of each value but the largest
+        starts = np.concatenate(([0], ends[:-1] + 1))
+        nLeft = ends + 1
+        nRight = n - nLeft
+        valid = (nLeft >= minSplit) & (nRight >= minSplit)
+        if not valid.any():
+            return None
+        ends, starts, nLeft, nRight = ends[valid], starts[valid], nLeft[valid], nRight[valid]
+
+        onehot = np.zeros((n, self.nClasses), dtype=np.int64)
+        onehot[np.arange(n), self.y[data][order]] = 1
+        left = np.cumsum(onehot, axis=0)[ends]
+        right = onehot.sum(axis=0) - left
+        infoX = nLeft / float(n) * self.entropy(left, nLeft) + nRight / float(n) * self.entropy(right, nRight)
+        gains = info - infoX
+
+        candidates = np.flatnonzero(gains == gains.max())
+        best = candidates[np.argmin(order[starts[candidates]])]
+        splitInfoX = -sum([float(m)/n * log(float(m)/n,2) for m in [nLeft[best], nRight[best]]])
+        return AttBestDetails(float(values[starts[best]]), float(gains[best]), splitInfoX)
+
+    def bestSubset(self, att, data, info, minSplit):
+        ''' Finds the best split of nominal att into a subset of categories
+            and the rest from its table of vectors in each category and
+            class. Categories present in data are ordered by the proportion
+            of the most frequent class of data, only subsets formed by the
+            first categories of this order are tried (Breiman et al. 1984,
+            the best subset for two classes). Time and memory do not depend
+            on the number of categories beyond the size of the table.
+            returns: AttBestDetails with the subset or None if no subset
+                     leaves minSplit vectors on both sides'''
+        n = len(data)
+        nCategories = len(self.nominal[att])
+        codes = self.X[data, att].astype(np.intp)
+        known = codes >= 0  # missing values go to the rest
+        table = np.bincount(codes[known] * self.nClasses + self.y[data][known], minlength=nCategories * self.nClasses)
+        table = table.reshape(nCategories, self.nClasses)
+        present = np.flatnonzero(table.sum(axis=1))
+        if len(present) < 2:
+            return None
+        table = table[present]
+        majority = np.argmax(table.sum(axis=0))
+        order = np.lexsort((present, -table[:, majority] / table.sum(axis=1).astype(float)))
+
+        left = np.cumsum(table[order], axis=0)[:-1]
+        nLeft = left.sum(axis=1)
+        nRight = n - nLeft
+        valid = np.flatnonzero((nLeft >= minSplit) & (nRight >= minSplit))
+        if len(valid) == 0:
+            return None
+        left, nLeft, nRight = left[valid], nLeft[valid], nRight[valid]
+        right = self.classCounts(data) - left
+        infoX = nLeft / float(n) * self.entropy(left, nLeft) + nRight / float(n) * self.entropy(right, nRight)
+        gains = info - infoX
+
+        best = np.argmax(gains) # the smallest subset among equal gains
+        subset = sorted(present[order[:valid[best] + 1]].tolist())
+        splitInfoX = -sum([float(m)/n * log(float(m)/n,2) for m in [nLeft[best], nRight[best]]])
+        return AttBestDetails(None, float(gains[best]), splitInfoX, subset)
+
+    def attributeCut(self, att, data, info, minSplit):
+        ''' bestSubset of a nominal attribute, bestCut of a continuous one '''
+        if att in self.nominal:
+            return self.bestSubset(att, data, info, minSplit)
+        return self.bestCut(att, data, info, minSplit)
+
+    def binHistogram(self, data):
+        ''' Counts vectors of data in each class for every bin of every
+            attribute, returns: array of shape (attributes, bins, classes) '''
+        p = self.codes.shape[1]
+        offsets = np.arange(p) * self.bins
+        hist = np.zeros(p * self.bins * self.nClasses, dtype=np.int64)
+        for start in xrange(0, len(data), self.blockSize):
+            block = data[start:start + self.blockSize]
+            index = (self.codes[block] + offsets) * self.nClasses + self.y[block][:, np.newaxis]
+            hist += np.bincount(index.ravel(), minlength=len(hist))
+        return hist.reshape(p, self.bins, self.nClasses)
+
+    def bestBinnedCuts(self, hist, info, minSplit):
+        ''' Finds the cut with the best gain for every attribute from class
+            histograms of bins, as bestCut does for exact values. A cut
+            after bin b sends bins up to b to the left. Among cuts with equal
+            gain the smallest one is chosen.
+            returns: list of AttBestDetails or None for every attribute'''
+        left = np.cumsum(hist, axis=1)
+        total = left[:, -1]
+        n = total[0].sum()
+        nLeft = left.sum(axis=2)
+        nRight = n - nLeft
+        valid = (hist.sum(axis=2) > 0) & (nLeft >= minSplit) & (nRight >= minSplit)
+        atts, cuts = np.nonzero(valid)
+        attBest = [None] * hist.shape[0]
+        if len(atts) == 0:
+            return attBest
+
+        nLeft, nRight = nLeft[atts, cuts], nRight[atts, cuts]
+        left = left[atts, cuts]
+        right = total[atts] - left
+        infoX = nLeft / float(n) * self.entropy(left, nLeft) + nRight / float(n) * self.entropy(right, nRight)
+        gains = info - infoX
+
+        order = np.lexsort((cuts, -gains, atts)) # by attribute, best gain first
+        firsts = order[np.flatnonzero(np.diff(np.concatenate(([-1], atts[order]))))]
+        for best in firsts:
+            att = atts[best]
+            splitInfoX = -sum([float(m)/n * log(float(m)/n,2) for m in [nLeft[best], nRight[best]]])
+            attBest[att] = AttBestDetails(float(self.binCuts[att][cuts[best]]), float(gains[best]), splitInfoX)
+        return attBest
+
+    def makeLeaf(self, data, counts):
+        ''' A leaf of the best class for vectors of data '''
         leaf = Tree()
         leaf.nodeType = 'leaf'
-        leaf.leaf, minCost, leaf.classDist = self.bestClassFromData(data)
+        leaf.leaf, minCost = self.bestClassFromCounts(counts)
+        leaf.classDist = self.classDistribution(counts)
         leaf.N = len(data)
         leaf.error = leaf.N - leaf.classDist[leaf.leaf] # factual number of errors at this leaf
-    
+        return leaf
+
+    def chooseTest(self, data, info, hist, leaf, pool=None):
+        ''' Selects the test with the best gain ratio for vectors of data,
+            attributes are searched in the pool if one is given
+            returns: Test or None when the node should not branch '''
         # no branching when:
         # - vectors belong to the same class
         # - there exist at least MINITEMS vectors for each subset
         MINITEMS = 2
         if leaf.classDist[leaf.leaf] > 0.999 * leaf.N or leaf.N < 2 * MINITEMS:
-            return leaf
+            return None
     
         # minSplit is between MINITEMS and 25
         minSplit = 0.1 * float(len(data))/self.nClasses
@@ -193,20 +358,19 @@ class C45:
         if minSplit < MINITEMS:
             minSplit = MINITEMS
     
-        availableAtts = range(len(data[0]) - 1) # all attributes allowed
-        attBest = [None for i in range(len(availableAtts))] # stores best cut, gain and split info for each attribute
-        for att in availableAtts:
-            self.sortByAtt(att, data)
-            for idx in range(len(data)):
-                X = Test(att, data[idx][att])
-                left, right = self.splitData(X, data)
-                if len(left) < minSplit or len(right) < minSplit:
-                    continue
-                infoX, infoLeft, infoRight = self.testInfo(X, left, right)
-                gainX = info - infoX
-                splitInfoX = self.splitInfo(left, right)
-                if attBest[att] is None or gainX > attBest[att].gain:
-                    attBest[att] = AttBestDetails(X.cut, gainX, splitInfoX)
+        availableAtts = range(self.X.shape[1]) if self.attributes is None else self.attributes
+        # stores best cut, gain and split info for each attribute
+        if self.bins:
+            attBest = self.bestBinnedCuts(hist, info, minSplit)
+            for att in availableAtts:
+                if att in self.nominal: # bins do not order categories
+                    attBest[att] = self.bestSubset(att, data, info, minSplit)
+        elif pool is not None:
+            attBest = self.parallelCuts(pool, data, info, minSplit)
+        else:
+            attBest = [None] * self.X.shape[1]
+            for att in availableAtts:
+                attBest[att] = self.attributeCut(att, data, info, minSplit)
     
         # compute average gain accross all attributes
         avgGain = 0
@@ -218,7 +382,7 @@ class C45:
     
         # do not try to split if it is not possible to produce any gain
         if possible == 0:
-            return leaf
+            return None
     
         avgGain = float(avgGain) / possible
     
@@ -230,26 +394,152 @@ class C45:
                 gainRatio = float(attBest[att].gain) / attBest[att].splitInfo
                 if maxGainRatio is None or gainRatio > maxGainRatio:
                     maxGainRatio = gainRatio
-                    bestTest = Test(att, attBest[att].cut)
-    
-        # try branching using best test
+                    bestTest = Test(att, attBest[att].cut, attBest[att].subset)
+        return bestTest
+
+    def parallelCuts(self, pool, data, info, minSplit):
+        ''' attributeCut of every attribute, attributes are divided among pool workers '''
+        p = self.X.shape[1]
+        learner = self.withoutData()
+        groups = [range(p)[i::self.nWorkers] for i in range(min(self.nWorkers, p))]
+        jobs = [pool.apply_async(findCuts, (learner, data, info, minSplit, atts)) for atts in groups]
+        attBest = [None] * p
+        for atts, job in zip(groups, jobs):
+            for att, best in zip(atts, job.get()):
+                attBest[att] = best
+        return attBest
+
+    def splitNode(self, data, test, counts, hist):
+        ''' Makes an internal node for test
+            returns: the node and data, info and hist of both subsets '''
         tree = Tree()
         tree.nodeType = 'internal'
-        tree.test = bestTest
-        left, right = self.splitData(bestTest, data)
-        infoX, infoLeft, infoRight = self.testInfo(bestTest, left, right)
-        tree.classDist = self.classDistribution(data)
-        tree.branches = []
-        tree.branches.append(self.constructTree(left, infoLeft))
-        tree.branches.append(self.constructTree(right, infoRight))
-        tree.error = tree.branches[0].error + tree.branches[1].error
+        tree.test = test
+        tree.classDist = self.classDistribution(counts)
         tree.N = len(data)
-    
-        # decide if branching gives a smaller error
+
+        isLeft = self.passesTest(data, test)
+        left, right = data[isLeft], data[~isLeft]
+        leftHist = rightHist = None
+        if self.bins:
+            # only the smaller subset is counted, the other one is the rest of this node
+            if len(left) <= len(right):
+                leftHist = self.binHistogram(left)
+                rightHist = hist - leftHist
+            else:
+                rightHist = self.binHistogram(right)
+                leftHist = hist - rightHist
+        subsets = [(left, self.entropy(self.classCounts(left), len(left)), leftHist),
+                   (right, self.entropy(self.classCounts(right), len(right)), rightHist)]
+        return tree, subsets
+
+    def passesTest(self, data, test):
+        ''' Tells which vectors of data go to the first branch of test '''
+        values = self.X[data, test.testedAtt]
+        if test.subset is None:
+            return values <= test.cut
+        inSubset = np.zeros(len(self.nominal[test.testedAtt]) + 1, dtype=bool) # the last for missing values
+        inSubset[test.subset] = True
+        return inSubset[values.astype(np.intp)]
+
+    def smallerError(self, tree, leaf):
+        ''' Returns the tree if branching gives a smaller error than the leaf '''
+        tree.error = tree.branches[0].error + tree.branches[1].error
         if tree.error < leaf.error:
             return tree
         else:
             return leaf
+
+    def constructTree(self, data=None, info=None, hist=None):
+        ''' Constructs a continuous-valued decision tree using the C4.5 algorithm
+            data: indices of learning vectors covered by the node, all by default
+            hist: binHistogram of data, when bins are used '''
+        if data is None:
+            data = np.arange(len(self.y))
+            self.prepareCosts()
+            if self.nWorkers > 1:
+                return self.constructInParallel(data)
+        if self.bins and hist is None:
+            hist = self.binHistogram(data)
+
+        counts = self.classCounts(data) if hist is None else hist[0].sum(axis=0)
+        if info is None:
+            info = self.entropy(counts, len(data))
+    
+        # make a leaf first, then see if try branching
+        leaf = self.makeLeaf(data, counts)
+        bestTest = self.chooseTest(data, info, hist, leaf)
+        if bestTest is None:
+            return leaf
+    
+        # try branching using best test
+        tree, subsets = self.splitNode(data, bestTest, counts, hist)
+        tree.branches = [self.constructTree(*subset) for subset in subsets]
+        return self.smallerError(tree, leaf)
+
+    def withoutData(self):
+        ''' A copy of this learner without learning data, to be sent to pool
+            workers, which read the data from shared memory '''
+        learner = copy(self)
+        learner.learnData = learner.X = learner.y = learner.codes = None
+        return learner
+
+    def attachShared(self):
+        ''' Uses learning data shared by the pool (in a worker) '''
+        self.X = shared.get_array('X')
+        self.y = shared.get_array('y')
+        if self.bins:
+            self.codes = shared.get_array('codes')
+
+    def constructInParallel(self, data):
+        ''' Constructs the tree in a pool of nWorkers processes sharing the
+            learning data. Nodes with more than subtreeSize vectors are split
+            here, their attributes are searched by workers, smaller subtrees
+            are constructed by workers as a whole. The tree is the same as
+            constructTree makes in one process. '''
+        arrays = {'X': self.X, 'y': self.y}
+        if self.bins:
+            arrays['codes'] = self.codes
+        pool = shared.pool(self.nWorkers, **arrays)
+        try:
+            tree = self.finishNode(self.growNode(pool, self.withoutData(), data, None, None))
+        except:
+            pool.terminate()
+            raise
+        pool.close()
+        pool.join()
+        return tree
+
+    def growNode(self, pool, learner, data, info, hist):
+        ''' constructTree of constructInParallel: returns a leaf, a pending
+            job for a small subtree or (tree, leaf) for a node whose branches
+            are still being constructed '''
+        if len(data) <= self.subtreeSize:
+            return pool.apply_async(constructSubtree, (learner, data, info, hist))
+        if self.bins and hist is None:
+            hist = self.binHistogram(data)
+        counts = self.classCounts(data) if hist is None else hist[0].sum(axis=0)
+        if info is None:
+            info = self.entropy(counts, len(data))
+
+        leaf = self.makeLeaf(data, counts)
+        bestTest = self.chooseTest(data, info, hist, leaf, pool)
+        if bestTest is None:
+            return leaf
+        tree, subsets = self.splitNode(data, bestTest, counts, hist)
+        tree.branches = [self.growNode(pool, learner, *subset) for subset in subsets]
+        return tree, leaf
+
+    def finishNode(self, node):
+        ''' Collects subtrees of workers and prunes branches which do not
+            give a smaller error, as constructTree does '''
+        if isinstance(node, tuple):
+            tree, leaf = node
+            tree.branches = [self.finishNode(branch) for branch in tree.branches]
+            return self.smallerError(tree, leaf)
+        if isinstance(node, Tree):
+            return node
+        return node.get()
     
     def getErrors(self, classDist, cls):
         E = sum([classDist[k] for k in classDist.keys() if k != cls]) # erorrs
@@ -344,39 +634,153 @@ class C45:
         return tree
 
 def classifyData(tree, data):
+    predicted = compileTree(tree).predictBatch(np.array([row[:-1] for row in data], dtype=float))
     errors = 0
-    for row in data:
-        cls = tree.getClass(row[:-1])
+    for row, cls in zip(data, predicted.tolist()):
         if int(row[-1]) != cls:
             row[-1] = cls
             errors += 1
     return data, errors
 
+def findCuts(learner, data, info, minSplit, atts):
+    ''' Pool worker: attributeCut of attributes atts over the shared learning data '''
+    learner.attachShared()
+    return [learner.attributeCut(att, data, info, minSplit) for att in atts]
+
+def constructSubtree(learner, data, info, hist):
+    ''' Pool worker: constructs the subtree of data over the shared learning data '''
+    learner.attachShared()
+    return learner.constructTree(data, info, hist)
+
+def classifyFile(tree, source, output, arff=False, chunkSize=10000):
+    ''' Classifies vectors of source (class in the last column) chunkSize
+        rows at a time and writes them with the assigned class to output
+        as they are classified; memory use does not grow with the file.
+        returns: number of errors, number of vectors and a confusion matrix,
+                 a Counter of (actual, predicted) class pairs '''
+    flatTree = compileTree(tree)
+    labels = dict((str(c), c) for c in flatTree.classes)
+    errors = 0
+    total = 0
+    confusion = Counter()
+    attributes = []
+    header = None
+    with open(source) as sourceFile:
+        with open(output, 'w') as outputFile:
+            if arff:
+                header = read_header(sourceFile)
+                outputFile.writelines(header)
+                attributes = arffAttributes(header)
+            writer = csv.writer(outputFile)
+            reader = (row for row in data_rows(sourceFile, header) if row and not row[0].startswith('%'))
+            while True:
+                rows = list(islice(reader, chunkSize))
+                if not rows:
+                    break
+                predicted = flatTree.predictBatch(encodeRows([row[:-1] for row in rows], attributes)).tolist()
+                actual = [labels.get(row[-1].strip(), row[-1].strip()) for row in rows]
+                confusion.update(zip(actual, predicted))
+                for row, cls in zip(rows, predicted):
+                    row[-1] = cls
+                writer.writerows(rows)
+                errors += sum(1 for a, p in zip(actual, predicted) if a != p)
+                total += len(rows)
+    return errors, total, confusion
+
+def printConfusion(confusion):
+    ''' Prints a confusion matrix: rows for actual, columns for predicted classes '''
+    classes = sorted(set(c for pair in confusion for c in pair))
+    print 'actual\\predicted\t' + '\t'.join(str(c) for c in classes)
+    for actual in classes:
+        print str(actual) + '\t' + '\t'.join(str(confusion[(actual, predicted)]) for predicted in classes)
+
+def countErrors(tree, X, y):
+    ''' Number of vectors of X classified not as y says '''
+    return int(np.sum(compileTree(tree).predictBatch(X) != np.asarray(y)))
+
+def learnAndClassify(source, output, Q=0.75, learnPart=80, testPart=20, bins=None, arff=False, nWorkers=None,
+                     nTrees=1):
+    ''' Learns a pruned tree, or a bagged ensemble of nTrees, on the first
+        learnPart percent of vectors in source and classifies the last
+        testPart percent of them. Testing vectors with the assigned class
+        are written to output. Nominal attributes of an ARFF source are
+        split on subsets of their declared values.
+        returns: testing data error rate '''
+    header = []
+    rows = []
+    with open(source) as sourceFile:
+        if arff:
+            header = read_header(sourceFile)
+        for row in data_rows(sourceFile, header if arff else None):
+            if row and not row[0].startswith('%'):
+                rows.append([value.strip() for value in row])
+
+    nLearn = len(rows) * learnPart // 100
+    nTest = len(rows) * testPart // 100
+    learnRows, testRows = rows[:nLearn], rows[len(rows) - nTest:]
+    attributes = arffAttributes(header)
+    nominal = nominalAttributes(attributes)
+    learnX = encodeRows([row[:-1] for row in learnRows], attributes)
+    learnY = [row[-1] for row in learnRows]
+    if nTrees > 1:
+        from ensemble import BaggedTrees # ensemble is built on this module
+        model = BaggedTrees(nTrees, nWorkers, bins=bins, Q=Q, nominal=nominal).learn(learnX, learnY)
+    else:
+        c45 = C45(learnX, y=learnY, bins=bins, nWorkers=nWorkers, nominal=nominal)
+        model = compileTree(c45.pruneTree(c45.constructTree(), Q))
+
+    errors = 0
+    with open(output, 'w') as outputFile:
+        outputFile.writelines(header)
+        writer = csv.writer(outputFile)
+        predicted = model.predictBatch(encodeRows([row[:-1] for row in testRows], attributes))
+        for row, cls in zip(testRows, predicted.tolist()):
+            if cls != row[-1]:
+                errors += 1
+            writer.writerow(row[:-1] + [cls])
+    return float(errors) / max(nTest, 1)
+
 if __name__ == "__main__":
     parser = OptionParser()
     parser.add_option("-l", "--lfile", dest="learnFile",
-                              help="Learning data (CSV file name)")
+                              help="Learning data (CSV or ARFF file name)")
     parser.add_option("-t", "--tfile", dest="testFile",
                               help="Testing data (CSV file name)")
     parser.add_option("-o", "--ofile", dest="outFile", help="Output file name to store testing data classification")
+    parser.add_option("-b", "--bins", dest="bins", type="int",
+                              help="Search splits among quantile bins (2 to 256) of each attribute, reports difference from exact search")
+    parser.add_option("-p", "--processes", dest="processes", type="int",
+                              help="Number of processes constructing the tree")
+    parser.add_option("-c", "--chunkSize", dest="chunkSize", type="int", default=10000,
+                              help="Testing data vectors classified at a time (default 10000)")
     (options, args) = parser.parse_args()
 
     learnFile = options.learnFile # e. g. vertebral_learn.csv
     testFile = options.testFile # e. g. vertebral_test.csv
     outFile = options.outFile # e. g. res
 
-    learnData = readData(learnFile)
-    c45= C45(learnData)
+    nominal = None
+    if learnFile.endswith('arff'):
+        learnX, learnY, nominal = readArff(learnFile)
+    else:
+        learnX, learnY = readMatrix(learnFile)
+    c45= C45(learnX, y=learnY, bins=options.bins, nWorkers=options.processes, nominal=nominal)
     tree = c45.constructTree()
     tree = c45.pruneTree(tree)
     printTree(tree)
 
-    testData = readData(testFile)
-
-    classifiedLearnData, learnErrors = classifyData(tree, learnData)
-    classifiedTestData, testErrors = classifyData(tree, testData)
+    learnErrors = countErrors(tree, learnX, learnY)
+    testErrors, testTotal, confusion = classifyFile(tree, testFile, outFile, arff=testFile.endswith('arff'),
+                                                    chunkSize=options.chunkSize)
 
-    writeData(classifiedTestData, outFile)
+    print "Learning data error: %d/%d (%f)" % (learnErrors, len(learnY), float(learnErrors)/len(learnY))
+    print "Testing data error: %d/%d (%f)" % (testErrors, testTotal, float(testErrors)/testTotal)
+    printConfusion(confusion)
 
-    print "Learning data error: %d/%d (%f)" % (learnErrors, len(learnData), float(learnErrors)/len(learnData))
-    print "Testing data error: %d/%d (%f)" % (testErrors, len(testData), float(testErrors)/len(testData))
+    if options.bins:
+        exact = C45(learnX, y=learnY, nWorkers=options.processes, nominal=nominal)
+        exactTree = exact.pruneTree(exact.constructTree())
+        exactErrors, testTotal, exactConfusion = classifyFile(exactTree, testFile, os.devnull, arff=testFile.endswith('arff'),
+                                                              chunkSize=options.chunkSize)
+        print "Exact search testing data error: %d/%d (%f), binned search difference: %+f" % (exactErrors, testTotal,
+            float(exactErrors)/testTotal, float(testErrors - exactErrors)/testTotal)
@@ -0,0 +1,111 @@
+# coding: utf-8
+import numpy as np
+from c45 import C45
+from flat import compileTree
+from algorithms import shared
+
+class BaggedTrees:
+    ''' Bagging (Breiman 1996) of C45 trees, optionally each tree using a
+        random subspace of attributes (Ho 1998). Trees are constructed over
+        the learning matrix itself, from bootstrap indices drawn for every
+        tree, in a pool of processes sharing the matrix if nWorkers > 1.
+        Vectors left out of a bootstrap sample vote with that tree for the
+        out-of-bag error. '''
+    nTrees = 25         # number of trees
+    nWorkers = None     # processes constructing trees, one if not set
+    subspace = None     # attributes chosen for each tree, all if not set
+    bins = None         # quantile bins for split search, see C45
+    Q = 0.75            # pruning confidence level, trees are not pruned if None
+    seed = None         # seed of bootstrap samples and subspaces
+    nominal = None      # {attribute: declared values} of nominal attributes, see C45
+    classes = None      # class values
+    trees = None        # FlatTree list, leaves assign indices of classes
+    oobError = None     # out-of-bag error rate
+    blockSize = 65536   # vectors classified at a time
+
+    def __init__(self, nTrees=25, nWorkers=None, subspace=None, bins=None, Q=0.75, seed=None, nominal=None):
+        self.nTrees = nTrees
+        self.nWorkers = nWorkers
+        self.subspace = subspace
+        self.bins = bins
+        self.Q = Q
+        self.seed = seed
+        self.nominal = nominal
+
+    def learn(self, X, y):
+        ''' Constructs the trees on matrix X with classes y, computes the out-of-bag error '''
+        X = np.asarray(X, dtype=float)
+        classes, yIndex = np.unique(y, return_inverse=True)
+        self.classes = classes.tolist()
+        seeds = np.random.RandomState(self.seed).randint(2**31 - 1, size=self.nTrees)
+        settings = BaggedTrees(self.nTrees, None, self.subspace, self.bins, self.Q, nominal=self.nominal)
+
+        pool = None
+        if self.nWorkers > 1:
+            pool = shared.pool(self.nWorkers, X=X, y=yIndex)
+            jobs = [pool.apply_async(constructBaggedTree, (settings, int(treeSeed))) for treeSeed in seeds]
+            results = (job.get() for job in jobs)
+        else:
+            results = (constructBaggedTree(settings, int(treeSeed), X, yIndex) for treeSeed in seeds)
+
+        votes = np.zeros((len(X), len(self.classes)), dtype=np.int32)
+        self.trees = []
+        try:
+            for tree, oob, predicted in results:
+                self.trees.append(tree)
+                votes[oob, predicted] += 1
+        except:
+            if pool is not None:
+                pool.terminate()
+            raise
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+        voted = votes.sum(axis=1) > 0
+        self.oobError = float(np.mean(votes[voted].argmax(axis=1) != yIndex[voted])) if voted.any() else None
+        return self
+
+    def predictBatch(self, X):
+        ''' Majority vote of the trees for every vector of X, ties go to the
+            first class '''
+        X = np.asarray(X, dtype=float)
+        leafClasses = [np.asarray(tree.classes)[tree.leaf] for tree in self.trees]
+        predicted = []
+        for start in xrange(0, len(X), self.blockSize):
+            block = X[start:start + self.blockSize]
+            votes = np.zeros((len(block), len(self.classes)), dtype=np.int32)
+            rows = np.arange(len(block))
+            for tree, classes in zip(self.trees, leafClasses):
+                votes[rows, classes[tree.nodesOf(block)]] += 1
+            predicted.append(votes.argmax(axis=1))
+        if not predicted:
+            return np.asarray(self.classes)[:0]
+        return np.asarray(self.classes)[np.concatenate(predicted)]
+
+def constructBaggedTree(settings, seed, X=None, y=None):
+    ''' Constructs a tree on a bootstrap sample of X (the shared matrix in a
+        pool worker) with class indices y
+        returns: FlatTree and out-of-bag vectors with their predicted classes '''
+    if X is None:
+        X = shared.get_array('X')
+        y = shared.get_array('y')
+    n, p = X.shape
+    rng = np.random.RandomState(seed)
+    sample = np.sort(rng.randint(0, n, n))
+
+    learner = C45(X, y=y, bins=settings.bins, nominal=settings.nominal)
+    if settings.subspace and settings.subspace < p:
+        learner.attributes = sorted(rng.permutation(p)[:settings.subspace].tolist())
+    learner.prepareCosts()
+    tree = learner.constructTree(sample)
+    if settings.Q:
+        tree = learner.pruneTree(tree, settings.Q)
+    tree = compileTree(tree)
+
+    oob = np.flatnonzero(np.bincount(sample, minlength=n) == 0)
+    predicted = np.empty(len(oob), dtype=np.intp)
+    for start in xrange(0, len(oob), tree.blockSize):
+        block = oob[start:start + tree.blockSize]
+        predicted[start:start + len(block)] = tree.predictBatch(X[block])
+    return tree, oob, predicted
@@ -0,0 +1,211 @@
+# coding: utf-8
+import json
+import struct
+import numpy as np
+
+# Model file: MAGIC, format version and header length (little endian
+# uint32), JSON header, then arrays, each starting at a multiple of 8 bytes
+# from the end of the header. The header lists classes, metadata and name,
+# dtype, shape and offset of every array. Version 1 files have no nominal
+# and subsets arrays.
+MAGIC = 'C45TREE\0'
+VERSION = 2
+ARRAYS = ['feature', 'threshold', 'left', 'right', 'leaf', 'classDist', 'nominal', 'subsets']
+
+class FlatTree:
+    ''' A tree compiled into arrays indexed by node number, the root is node 0.
+        Internal nodes send a vector to left[node] if its attribute
+        feature[node] is <= threshold[node], to right[node] otherwise.
+        Leaves have feature -1 and assign classes[leaf[node]]. A node
+        testing a nominal attribute sends a vector left if subsets[nominal[node]]
+        is True at the index of its category instead. '''
+    feature = None      # tested attribute, -1 at leaves
+    threshold = None    # cut value of the test
+    left = None         # child for vectors passing the test, -1 at leaves
+    right = None        # child for other vectors, -1 at leaves
+    leaf = None         # index of the assigned class in classes
+    classDist = None    # class distribution of every node, a column for each class
+    nominal = None      # row of subsets for nodes testing a nominal attribute, -1 otherwise
+    subsets = None      # categories going left, a bool row for each nominal test
+    classes = None      # class values
+    metadata = None     # dict saved with the model
+    blockSize = 65536   # vectors routed at a time
+
+    def __init__(self, feature, threshold, left, right, leaf, classDist, classes, metadata=None,
+                 nominal=None, subsets=None):
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.leaf = leaf
+        self.classDist = classDist
+        self.classes = classes
+        self.metadata = metadata or {}
+        if nominal is None:
+            nominal = -np.ones(len(feature), dtype=np.int32)
+        if subsets is None:
+            subsets = np.zeros((0, 0), dtype=bool)
+        self.nominal = nominal
+        self.subsets = subsets
+
+    def inSubsets(self, rows, values):
+        ''' Tells if categories values are in subsets of the given rows,
+            categories unknown to the tree are not '''
+        codes = np.asarray(values).astype(np.intp)
+        known = (codes >= 0) & (codes < self.subsets.shape[1])
+        member = np.zeros(len(codes), dtype=bool)
+        member[known] = self.subsets[rows[known], codes[known]]
+        return member
+
+    def getClass(self, vector):
+        '''Returns vectors class.'''
+        node = 0
+        while self.feature[node] >= 0:
+            if self.nominal[node] >= 0:
+                isLeft = self.inSubsets(self.nominal[node:node + 1], [vector[self.feature[node]]])[0]
+            else:
+                isLeft = vector[self.feature[node]] <= self.threshold[node]
+            if isLeft:
+                node = self.left[node]
+            else:
+                node = self.right[node]
+        return self.classes[self.leaf[node]]
+
+    def nodesOf(self, X):
+        ''' Leaf reached by every vector of X. All vectors are routed
+            together, one tree level at a time. '''
+        X = np.asarray(X, dtype=float)
+        nodes = np.zeros(len(X), dtype=np.int32)
+        active = np.arange(len(X))
+        while len(active):
+            current = nodes[active]
+            internal = self.feature[current] >= 0
+            active = active[internal]
+            current = current[internal]
+            values = X[active, self.feature[current]]
+            isLeft = values <= self.threshold[current]
+            rows = self.nominal[current]
+            isNominal = rows >= 0
+            if isNominal.any():
+                isLeft[isNominal] = self.inSubsets(rows[isNominal], values[isNominal])
+            nodes[active] = np.where(isLeft, self.left[current], self.right[current])
+        return nodes
+
+    def predictBatch(self, X):
+        ''' Classes of all vectors of X, blockSize vectors at a time '''
+        classes = np.asarray(self.classes)
+        predicted = []
+        for start in xrange(0, len(X), self.blockSize):
+            predicted.append(classes[self.leaf[self.nodesOf(X[start:start + self.blockSize])]])
+        if not predicted:
+            return classes[:0]
+        return np.concatenate(predicted)
+
+    def countLeaves(self):
+        return int(np.sum(self.feature < 0))
+
+    def save(self, filename, metadata=None):
+        ''' Writes the model file, metadata (JSON serialisable) is stored in its header '''
+        if metadata is None:
+            metadata = self.metadata
+        header = {'version': VERSION, 'classes': list(self.classes), 'metadata': metadata, 'arrays': []}
+        offset = 0
+        for name in ARRAYS:
+            array = np.ascontiguousarray(getattr(self, name))
+            header['arrays'].append({'name': name, 'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset})
+            offset += padded(array.nbytes)
+        headerBytes = json.dumps(header)
+        with open(filename, 'wb') as modelFile:
+            modelFile.write(MAGIC)
+            modelFile.write(struct.pack('<II', VERSION, len(headerBytes)))
+            modelFile.write(headerBytes)
+            modelFile.write('\0' * (padded(len(headerBytes)) - len(headerBytes)))
+            for name in ARRAYS:
+                data = np.ascontiguousarray(getattr(self, name)).tostring()
+                modelFile.write(data)
+                modelFile.write('\0' * (padded(len(data)) - len(data)))
+
+def padded(size):
+    return (size + 7) // 8 * 8
+
+def isModelFile(filename):
+    ''' Tells if the file is a model file, not a legacy pickle '''
+    with open(filename, 'rb') as modelFile:
+        return modelFile.read(len(MAGIC)) == MAGIC
+
+def loadFlatTree(filename, mmap=True):
+    ''' Reads a model file. With mmap arrays are memory-mapped read only, so
+        processes loading the same file share its pages. '''
+    with open(filename, 'rb') as modelFile:
+        if modelFile.read(len(MAGIC)) != MAGIC:
+            raise ValueError('%s is not a tree model file' % filename)
+        version, headerLength = struct.unpack('<II', modelFile.read(8))
+        if version > VERSION:
+            raise ValueError('Tree model file version %d is not supported (at most %d)' % (version, VERSION))
+        header = json.loads(modelFile.read(headerLength))
+        dataStart = len(MAGIC) + 8 + padded(headerLength)
+        if not mmap:
+            modelFile.seek(dataStart)
+            data = modelFile.read()
+
+    arrays = {}
+    for entry in header['arrays']:
+        dtype = np.dtype(str(entry['dtype']))
+        shape = tuple(entry['shape'])
+        size = int(np.prod(shape))
+        if size == 0:
+            array = np.zeros(shape, dtype=dtype)
+        elif mmap:
+            array = np.memmap(filename, dtype=dtype, mode='r', offset=dataStart + entry['offset'], shape=shape)
+        else:
+            start = entry['offset']
+            array = np.frombuffer(data[start:start + size * dtype.itemsize], dtype=dtype).reshape(shape)
+        arrays[str(entry['name'])] = array
+    return FlatTree(classes=header['classes'], metadata=header['metadata'], **arrays)
+
+def compileTree(tree):
+    ''' Compiles a (pruned) Tree into a FlatTree, nodes are numbered level by level '''
+    nodes = [tree]
+    for node in nodes:
+        if node.nodeType == 'internal':
+            nodes.extend(node.branches)
+
+    classes = set()
+    for node in nodes:
+        if node.classDist is not None:
+            classes.update(node.classDist.keys())
+        if node.nodeType == 'leaf':
+            classes.add(node.leaf)
+    classes = sorted(classes)
+    classIndex = dict((c, i) for i, c in enumerate(classes))
+
+    n = len(nodes)
+    feature = -np.ones(n, dtype=np.int32)
+    threshold = np.zeros(n)
+    left = -np.ones(n, dtype=np.int32)
+    right = -np.ones(n, dtype=np.int32)
+    leaf = np.zeros(n, dtype=np.int32)
+    classDist = np.zeros((n, len(classes)))
+    nominal = -np.ones(n, dtype=np.int32)
+    subsets = []
+    number = dict((id(node), i) for i, node in enumerate(nodes))
+    for i, node in enumerate(nodes):
+        if node.classDist is not None:
+            for c, count in node.classDist.items():
+                classDist[i, classIndex[c]] = count
+        if node.nodeType == 'internal':
+            feature[i] = node.test.testedAtt
+            if node.test.subset is None:
+                threshold[i] = node.test.cut
+            else:
+                nominal[i] = len(subsets)
+                subsets.append(node.test.subset)
+            left[i] = number[id(node.branches[0])]
+            right[i] = number[id(node.branches[1])]
+        else:
+            leaf[i] = classIndex[node.leaf]
+    width = max([max(subset) + 1 for subset in subsets if subset] or [0])
+    subsetRows = np.zeros((len(subsets), width), dtype=bool)
+    for row, subset in enumerate(subsets):
+        subsetRows[row, subset] = True
+    return FlatTree(feature, threshold, left, right, leaf, classDist, classes, nominal=nominal, subsets=subsetRows)
@@ -0,0 +1,206 @@
+# coding: utf-8
+#! usr/bin/python
+
+import os
+from math import log, sqrt
+import numpy as np
+from scipy.special import ndtr
+from optparse import OptionParser
+from c45 import Tree, Test, classifyFile, printConfusion
+from sm_utils import printTree, saveTree
+from tools import readRows
+
+class ClassObserver:
+    ''' Number of vectors of one class at a leaf with mean, sum of squared
+        differences from the mean (Welford), minimum and maximum of every attribute '''
+    n = None
+    mean = None
+    m2 = None
+    minimum = None
+    maximum = None
+
+    def __init__(self, p):
+        self.n = 0
+        self.mean = np.zeros(p)
+        self.m2 = np.zeros(p)
+        self.minimum = np.empty(p)
+        self.minimum.fill(np.inf)
+        self.maximum = np.empty(p)
+        self.maximum.fill(-np.inf)
+
+    def add(self, vector):
+        self.n += 1
+        delta = vector - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (vector - self.mean)
+        np.minimum(self.minimum, vector, out=self.minimum)
+        np.maximum(self.maximum, vector, out=self.maximum)
+
+    def std(self):
+        return np.sqrt(self.m2 / self.n)
+
+class HoeffdingNode:
+    ''' A leaf collecting statistics or, once split, an internal node '''
+    test = None         # an instance of Test, None at leaves
+    branches = None     # a list of HoeffdingNode
+    classCounts = None  # (estimated) number of vectors in each class
+    observers = None    # ClassObserver for each class, at leaves
+    seen = 0            # vectors learnt at this leaf
+    lastEvaluation = 0  # seen when splitting was last considered
+
+    def __init__(self, classCounts=None):
+        self.classCounts = dict(classCounts or {})
+        self.observers = {}
+
+    def bestClass(self):
+        ''' Most frequent class, the smallest one of equally frequent '''
+        if not self.classCounts:
+            return None
+        return min(self.classCounts, key=lambda c: (-self.classCounts[c], c))
+
+def entropy(counts):
+    ''' info(S) for class counts along the last axis '''
+    n = counts.sum(axis=-1)[..., np.newaxis]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        p = counts / n
+        terms = np.where(counts > 0, p * (np.log(p) / log(2)), 0.0)
+    return -terms.sum(axis=-1)
+
+class HoeffdingTree:
+    ''' Very fast decision tree (Domingos, Hulten 2000) for continuous
+        attributes: learns from a stream of vectors in one pass. A leaf is
+        split on the best of splitPoints cuts of every attribute, estimated
+        from normal distributions of each class, once the Hoeffding bound
+        says it is better than the second best with probability 1 - delta. '''
+    root = None
+    gracePeriod = 200           # vectors learnt at a leaf between split attempts
+    delta = 1e-7                # allowed probability of choosing a wrong split
+    tieThreshold = 0.05         # split anyway when the bound is below this
+    splitPoints = 10            # evenly spaced cuts tried between minimum and maximum
+    minBranchFraction = 0.01    # fraction of leaf vectors a branch must get
+    classes = None              # class values seen
+
+    def __init__(self, gracePeriod=200, delta=1e-7, tieThreshold=0.05):
+        self.root = HoeffdingNode()
+        self.gracePeriod = gracePeriod
+        self.delta = delta
+        self.tieThreshold = tieThreshold
+        self.classes = set()
+
+    def learn(self, rows):
+        ''' Learns vectors with class in the last column, e. g. from tools.readRows '''
+        for row in rows:
+            self.learnOne(row[:-1], row[-1])
+        return self
+
+    def learnOne(self, vector, cls):
+        vector = np.asarray(vector, dtype=float)
+        self.classes.add(cls)
+        node = self.root
+        while node.test is not None:
+            node.classCounts[cls] = node.classCounts.get(cls, 0) + 1
+            node = node.branches[0] if node.test.isValid(vector) else node.branches[1]
+
+        node.classCounts[cls] = node.classCounts.get(cls, 0) + 1
+        if cls not in node.observers:
+            node.observers[cls] = ClassObserver(len(vector))
+        node.observers[cls].add(vector)
+        node.seen += 1
+        if node.seen - node.lastEvaluation >= self.gracePeriod:
+            node.lastEvaluation = node.seen
+            self.trySplit(node)
+
+    def candidateSplits(self, node):
+        ''' Best cut of every attribute with estimated class counts on both sides
+            returns: gains, cuts, left and right counts, a row for each attribute '''
+        classes = sorted(node.observers)
+        observers = [node.observers[c] for c in classes]
+        counts = np.array([o.n for o in observers], dtype=float)
+        means = np.array([o.mean for o in observers]).T[:, np.newaxis, :]      # attribute, cut, class
+        stds = np.array([o.std() for o in observers]).T[:, np.newaxis, :]
+        minimums = np.array([o.minimum for o in observers]).T[:, np.newaxis, :]
+        maximums = np.array([o.maximum for o in observers]).T[:, np.newaxis, :]
+
+        low, high = minimums.min(axis=2), maximums.max(axis=2)
+        steps = np.arange(1, self.splitPoints + 1) / float(self.splitPoints + 1)
+        cuts = low + (high - low) * steps                                   # attribute, cut
+        t = cuts[:, :, np.newaxis]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            below = np.where(stds > 0, ndtr((t - means) / stds), means <= t)
+        below = np.where(t < minimums, 0.0, np.where(t >= maximums, 1.0, below))
+        left = counts * below
+        right = counts - left
+
+        n = counts.sum()
+        nLeft = left.sum(axis=2)
+        gains = entropy(counts) - (nLeft / n * entropy(left) + (n - nLeft) / n * entropy(right))
+        valid = (nLeft >= self.minBranchFraction * n) & (n - nLeft >= self.minBranchFraction * n)
+        gains = np.where(valid, gains, -np.inf)
+
+        best = gains.argmax(axis=1)
+        atts = np.arange(len(best))
+        return classes, gains[atts, best], cuts[atts, best], left[atts, best], right[atts, best]
+
+    def trySplit(self, node):
+        if len(node.observers) < 2:
+            return
+        classes, gains, cuts, left, right = self.candidateSplits(node)
+        order = np.argsort(-gains)
+        best = order[0]
+        second = gains[order[1]] if len(order) > 1 else 0.0
+        second = max(second, 0.0) # not splitting has no gain
+        if gains[best] <= 0:
+            return
+
+        R = log(max(len(self.classes), 2), 2)
+        bound = sqrt(R * R * log(1 / self.delta) / (2 * node.seen))
+        if gains[best] - second > bound or bound < self.tieThreshold:
+            node.test = Test(int(best), float(cuts[best]))
+            node.branches = [HoeffdingNode(zip(classes, left[best])), HoeffdingNode(zip(classes, right[best]))]
+            node.observers = None
+
+    def toTree(self, node=None):
+        ''' Exports the tree as Tree, which can be printed, compiled or saved '''
+        if node is None:
+            node = self.root
+        tree = Tree()
+        tree.classDist = dict(node.classCounts)
+        tree.N = sum(tree.classDist.values())
+        if node.test is None:
+            tree.nodeType = 'leaf'
+            tree.leaf = node.bestClass()
+            tree.error = tree.N - tree.classDist.get(tree.leaf, 0)
+        else:
+            tree.nodeType = 'internal'
+            tree.test = node.test
+            tree.branches = [self.toTree(branch) for branch in node.branches]
+            tree.error = tree.branches[0].error + tree.branches[1].error
+        return tree
+
+if __name__ == "__main__":
+    parser = OptionParser()
+    parser.add_option("-l", "--lfile", dest="learnFile",
+                              help="Learning data (CSV or ARFF file name), read once")
+    parser.add_option("-t", "--tfile", dest="testFile",
+                              help="Testing data (CSV or ARFF file name)")
+    parser.add_option("-o", "--ofile", dest="outFile", help="Output file name to store testing data classification")
+    parser.add_option("-m", "--model", dest="modelFile", help="File name to save the tree to")
+    parser.add_option("-g", "--gracePeriod", dest="gracePeriod", type="int", default=200,
+                              help="Vectors learnt at a leaf between split attempts (default 200)")
+    parser.add_option("-d", "--delta", dest="delta", type="float", default=1e-7,
+                              help="Allowed probability of a wrong split (default 1e-7)")
+    (options, args) = parser.parse_args()
+
+    learnFile = options.learnFile
+    learner = HoeffdingTree(options.gracePeriod, options.delta)
+    learner.learn(readRows(learnFile, arff=learnFile.endswith('arff')))
+    tree = learner.toTree()
+    printTree(tree)
+
+    if options.modelFile:
+        saveTree(options.modelFile, tree, {'learnFile': learnFile, 'learner': 'hoeffding'})
+    if options.testFile:
+        testErrors, testTotal, confusion = classifyFile(tree, options.testFile, options.outFile or os.devnull,
+                                                        arff=options.testFile.endswith('arff'))
+        print "Testing data error: %d/%d (%f)" % (testErrors, testTotal, float(testErrors)/testTotal)
+        printConfusion(confusion)
@@ -1,18 +1,28 @@
 # coding: utf-8
+from collections import OrderedDict
 from matplotlib import pyplot as plt
-from pickle import dump, load
-from numpy import arange
+from matplotlib.colors import colorConverter
+from pickle import load
+from numpy import arange, array, column_stack, meshgrid, unique
+from os.path import getmtime
 import sys
 from tools import readData, classDistribution, colors
+from flat import compileTree, isModelFile, loadFlatTree
 
 ##########   Medžių priemonės   ##########
-def loadTree(filename):
-    '''Reads tree, saved in file.'''
-    return load(open(filename))
+def loadTree(filename, mmap=True):
+    '''Reads tree, saved in file. A model file is loaded as FlatTree,
+    memory-mapped unless mmap is False; legacy pickled trees still load.'''
+    if isModelFile(filename):
+        return loadFlatTree(filename, mmap)
+    return load(open(filename, 'rb'))
 
-def saveTree(filename, tree):
-    '''Saves tree in human unreadable format.'''
-    dump(tree, open(filename, 'w'))
+def saveTree(filename, tree, metadata=None):
+    '''Saves tree (Tree or FlatTree) as a model file, with optional metadata
+    dict in its header.'''
+    if not hasattr(tree, 'predictBatch'):
+        tree = compileTree(tree)
+    tree.save(filename, metadata)
 
 def classDistStr(classDist, precision=None):
     res = None
@@ -30,13 +40,19 @@ def classDistStr(classDist, precision=None):
         res += '}'
     return res
 
+def testStr(test, passed=True):
+    if test.subset is not None:
+        subset = '{%s}' % ', '.join(str(c) for c in test.subset)
+        return '%d %s %s' % (test.testedAtt, 'in' if passed else 'not in', subset)
+    return '%d %s %.3f' % (test.testedAtt, '<=' if passed else '>', test.cut)
+
 def printTree(tree, indent='', indentStep='', childLink = ''):
     if tree.nodeType == 'internal':
         sys.stdout.write(indent+childLink)
-        sys.stdout.write('%d <= %.3f' % (tree.test.testedAtt, tree.test.cut))
+        sys.stdout.write(testStr(tree.test))
         if tree.branches[0].nodeType == 'leaf':
             leaf = tree.branches[0]
-            sys.stdout.write(': %d\t' % (leaf.leaf))
+            sys.stdout.write(': %s\t' % (leaf.leaf))
             if leaf.error is not None:
                 print '(%s/%.3f), %s' % (leaf.N, leaf.error, classDistStr(leaf.classDist, 3))
             else:
@@ -45,10 +61,10 @@ def printTree(tree, indent='', indentStep='', childLink = ''):
             print
             printTree(tree.branches[0], indent + indentStep, ':   ', ':...')
         sys.stdout.write(indent + indentStep)
-        sys.stdout.write('%d > %.3f' % (tree.test.testedAtt, tree.test.cut))
+        sys.stdout.write(testStr(tree.test, False))
         if tree.branches[1].nodeType == 'leaf':
             leaf = tree.branches[1]
-            sys.stdout.write(': %d\t' % (leaf.leaf))
+            sys.stdout.write(': %s\t' % (leaf.leaf))
             if leaf.error is not None:
                 print '(%s/%.3f), %s' % (leaf.N, leaf.error, classDistStr(leaf.classDist, 3))
             else:
@@ -57,14 +73,34 @@ def printTree(tree, indent='', indentStep='', childLink = ''):
             print
             printTree(tree.branches[1], indent + indentStep, '    ', ':...')
     elif childLink == '':
-        sys.stdout.write(': %d\t' % (tree.leaf))
+        sys.stdout.write(': %s\t' % (tree.leaf))
         print '(%s / %s), %s' % (tree.N, tree.error, tree.classDist)
 
 
-def drawTree(dataFile, treeFile, colors=colors, save_to=''):
+# Decision surfaces of model files drawn before, by file, its modification
+# time, plot bounds, resolution and colors; only the surfaceCacheSize most
+# recently drawn are kept
+surfaceCache = OrderedDict()
+surfaceCacheSize = 8
+
+def decisionSurface(tree, bounds, resolution, colors=colors):
+    '''Classifies a resolution x resolution grid within bounds (min_x, max_x,
+    min_y, max_y) in one batch, returns it as an RGB image of background colors.'''
+    if not hasattr(tree, 'predictBatch'):
+        tree = compileTree(tree)
+    min_x, max_x, min_y, max_y = bounds
+    xs = min_x + (arange(resolution) + 0.5) * (max_x - min_x) / resolution
+    ys = min_y + (arange(resolution) + 0.5) * (max_y - min_y) / resolution
+    grid_x, grid_y = meshgrid(xs, ys)
+    predicted = tree.leaf[tree.nodesOf(column_stack([grid_x.ravel(), grid_y.ravel()]))]
+    palette = array([colorConverter.to_rgb(colors[int(cls)][1]) for cls in tree.classes])
+    return palette[predicted].reshape(resolution, resolution, 3)
+
+def drawTree(dataFile, treeFile, colors=colors, save_to='', resolution=400):
     '''Draws 2D plot and displays in it:
          ``data``: (att1, ..., attN, class)
-         ``tree`` - displays as colored background
+         ``tree`` - displays as colored background, an image of
+                    ``resolution`` x ``resolution`` cells
     '''
     if type(dataFile) == str:
         data = readData(dataFile)
@@ -80,25 +116,10 @@ def drawTree(dataFile, treeFile, colors=colors, save_to=''):
         print "Too many attributes (%d), could draw only 2D plots..." % attribute_count
         return 1
 
-    # Divide data vectors by their class, x, y; find min, max values.
-    point_dict = dict()
-    min_x, max_x, min_y, max_y = None, None, None, None
-    for record in data:
-        vector, cls = record[:-1], record[-1]
-        if not point_dict.has_key(cls):
-            point_dict[cls] = [[],[]]
-        x = vector[0]
-        y = vector[1]
-        point_dict[cls][0].append(x)
-        point_dict[cls][1].append(y)
-        if not min_x or x < min_x:
-            min_x = x
-        if not max_x or x > max_x:
-            max_x = x
-        if not min_y or y < min_y:
-            min_y = y
-        if not max_y or y > max_y:
-            max_y = y
+    points = array(data, dtype=float)
+    classes = points[:, -1].astype(int)
+    min_x, min_y = points[:, :2].min(axis=0)
+    max_x, max_y = points[:, :2].max(axis=0)
 
     # Draw tree:
     point_cons = 400
@@ -106,24 +127,25 @@ def drawTree(dataFile, treeFile, colors=colors, save_to=''):
     max_x += 2 * (min_x + max_x) / point_cons
     min_y -= 2 * (min_y + max_y) / point_cons
     max_y += 2 * (min_y + max_y) / point_cons
+    bounds = (min_x, max_x, min_y, max_y)
 
     ## Draw tree:
-    tree_dict = dict()
-    for x in arange(min_x, max_x, (max_x - min_x) / point_cons):
-        for y in arange(min_y, max_y, (max_y - min_y) / point_cons):
-            point_cls = tree.getClass([x, y])
-            if not tree_dict.has_key(point_cls):
-                tree_dict[point_cls] = [[],[]]
-            tree_dict[point_cls][0].append(x)
-            tree_dict[point_cls][1].append(y)
-
-    for cls in tree_dict:
-        plt.scatter(tree_dict[cls][0], tree_dict[cls][1], 2,
-                                c=colors[int(cls)][1], marker='s', linewidth=0)
+    if type(treeFile) == str:
+        key = (treeFile, getmtime(treeFile), bounds, resolution, tuple(color[1] for color in colors))
+        image = surfaceCache.pop(key, None)
+        if image is None:
+            image = decisionSurface(tree, bounds, resolution, colors)
+        surfaceCache[key] = image
+        while len(surfaceCache) > surfaceCacheSize:
+            surfaceCache.popitem(last=False)
+    else:
+        image = decisionSurface(tree, bounds, resolution, colors)
+    plt.imshow(image, origin='lower', extent=bounds, aspect='auto', interpolation='nearest')
 
     # Draw data points:
-    for cls in point_dict:
-        plt.scatter(point_dict[cls][0], point_dict[cls][1], 33,
+    for cls in unique(classes):
+        in_class = classes == cls
+        plt.scatter(points[in_class, 0], points[in_class, 1], 33,
                                 c=colors[int(cls)][0], marker='o')
     plt.axis([min_x, max_x, min_y, max_y])
     plt.title(', '.join([colors[cls][2] + ': ' + str(count) for (cls, count) in
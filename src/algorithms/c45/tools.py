@@ -1,4 +1,7 @@
 import csv
+from array import array
+import numpy as np
+from algorithms.arff_data import read_header, data_rows
 
 # Classification colors: (point color, background color)
 colors = [
@@ -14,6 +17,8 @@ colors = [
           ('#660099', '#9966FF', 'purple', 'o'),
           ('#5C5C5C', '#C2C2C2', 'gray', 's')]
 
+MISSING = -1    # code of a missing (?) value of a nominal attribute
+
 def readData(inFile):
     ''' Reads data vectors with last column denoting class'''
     csvfile = open(inFile, 'rb')
@@ -25,6 +30,97 @@ def readData(inFile):
         data.append(v)
     return data
 
+def readMatrix(inFile):
+    ''' Reads data vectors with last column denoting class, returns a float
+        matrix of attributes and an int vector of classes'''
+    csvfile = open(inFile, 'rb')
+    reader = csv.reader(csvfile, delimiter=',', quotechar='"')
+    attributes = array('d')
+    classes = array('l')
+    for row in reader:
+        attributes.extend(map(float, row[:-1]))
+        classes.append(int(row[-1]))
+    csvfile.close()
+    X = np.frombuffer(attributes, dtype=float).reshape(len(classes), -1)
+    return X, np.frombuffer(classes, dtype=np.dtype('l')).astype(int)
+
+def readRows(inFile, arff=False):
+    ''' Yields data vectors with last column denoting class one by one, from
+        a CSV file or data (dense or sparse) of an ARFF file, where classes
+        are kept as strings. Attributes have to be numeric, an ARFF file
+        with nominal ones (but the class) raises a ValueError'''
+    csvfile = open(inFile, 'rb')
+    header = read_header(csvfile) if arff else None
+    if arff:
+        nominal = nominalAttributes(arffAttributes(header))
+        if nominal:
+            csvfile.close()
+            raise ValueError('%s: nominal attributes (%s) are not supported, attributes have to be numeric'
+                             % (inFile, ', '.join(map(str, sorted(nominal)))))
+    for row in data_rows(csvfile, header):
+        if not row or row[0].startswith('%'):
+            continue
+        v = map(float, row[:-1])
+        v.append(row[-1].strip() if arff else int(row[-1]))
+        yield v
+    csvfile.close()
+
+def arffAttributes(header):
+    ''' Declared values of every attribute in ARFF header lines, None for
+        numeric ones, e. g. [None, ['a', 'b'], ['yes', 'no']] for
+        @attribute x real, @attribute y {a, b}, @attribute class {yes, no}'''
+    attributes = []
+    for line in header:
+        line = line.strip()
+        if not line.lower().startswith('@attribute'):
+            continue
+        if line.endswith('}') and '{' in line:
+            values = line[line.index('{') + 1:-1]
+            attributes.append([value.strip().strip('\'"') for value in next(csv.reader([values], skipinitialspace=True))])
+        else:
+            attributes.append(None)
+    return attributes
+
+def nominalAttributes(attributes):
+    ''' {attribute: declared values} of nominal arffAttributes but the class '''
+    return dict((att, values) for att, values in enumerate(attributes[:-1]) if values is not None)
+
+def encodeRows(rows, attributes=()):
+    ''' Float matrix of rows, values of nominal attributes (arffAttributes)
+        are replaced by their index among the declared values, missing ones
+        (?) by MISSING, which no subset of a nominal test contains '''
+    indices = [dict((value, i) for i, value in enumerate(values)) if values else None for values in attributes]
+    if not any(indices):
+        return np.array(rows, dtype=float).reshape(len(rows), -1)
+    for index in indices:
+        if index is not None:
+            index.setdefault('?', MISSING)
+    encoded = [[encodeValue(value, att, index) for att, (value, index) in enumerate(zip(row, indices))] for row in rows]
+    return np.array(encoded, dtype=float).reshape(len(rows), -1)
+
+def encodeValue(value, att, index):
+    ''' Index of the value of nominal attribute att, float of a numeric one
+        (index is None) '''
+    if index is None:
+        return float(value)
+    try:
+        return index[value.strip()]
+    except KeyError:
+        raise ValueError('value %r of attribute %d is not declared' % (value.strip(), att))
+
+def readArff(inFile):
+    ''' Reads data (dense or sparse) of an ARFF file with class in the last column, values of
+        nominal attributes are indices of the declared values
+        returns: float matrix of attributes, classes as strings and
+                 {attribute: declared values} of nominal attributes'''
+    csvfile = open(inFile, 'rb')
+    header = read_header(csvfile)
+    rows = list(data_rows(csvfile, header))
+    csvfile.close()
+    attributes = arffAttributes(header)
+    X = encodeRows([row[:-1] for row in rows], attributes)
+    return X, [row[-1].strip() for row in rows], nominalAttributes(attributes)
+
 def writeData(data, outFile):
     csvfile = open(outFile, 'wb')
     writer = csv.writer(csvfile, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
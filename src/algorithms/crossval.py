@@ -0,0 +1,139 @@
+import resource
+import time
+import numpy as np
+from optparse import OptionParser
+
+import shared
+from c45.c45 import C45
+from c45.flat import compileTree
+from c45.tools import readMatrix
+from kmeans import UnsupervisedKMeans
+
+
+def stratified_folds(y, k=10, seed=None):
+    '''Splits row indices into ``k`` test folds keeping the class proportions
+    of ``y``: the rows of every class are shuffled and dealt to the folds in
+    turn, continuing from the fold the previous class stopped at.
+    returns: list of sorted index arrays'''
+    y = np.asarray(y)
+    rng = np.random.RandomState(seed)
+    classes, labels = np.unique(y, return_inverse=True)
+    folds = [[] for i in range(k)]
+    start = 0
+    for cls in range(len(classes)):
+        rows = rng.permutation(np.flatnonzero(labels == cls))
+        for i in range(k):
+            folds[(start + i) % k].append(rows[i::k])
+        start = (start + len(rows)) % k
+    return [np.sort(np.concatenate(fold)).astype(np.intp) for fold in folds]
+
+
+def c45_fold(X, y, train, test, Q=0.75, bins=None):
+    '''Learns a pruned C45 tree on rows ``train`` and tests it on rows
+    ``test``. The tree is grown on the indices, so the training rows are
+    not copied.'''
+    learner = C45(X, y=y, bins=bins)
+    learner.prepareCosts()
+    tree = compileTree(learner.pruneTree(learner.constructTree(train), Q))
+    predicted = tree.predictBatch(X[test])
+    return {'error': float(np.mean(predicted != y[test])), 'leaves': tree.countLeaves()}
+
+
+def kmeans_fold(X, y, train, test, k=None, seed=None):
+    '''Groups rows ``train`` into ``k`` groups (the number of classes by
+    default) and assigns rows ``test`` to the closest means. Reports the
+    squared distance of a test row to its mean and purity: the fraction of
+    test rows whose class is the most frequent class of their group in the
+    training rows.'''
+    classes, labels = np.unique(y, return_inverse=True)
+    k = k or len(classes)
+    kmeans = UnsupervisedKMeans()
+    rng = np.random.RandomState(seed)
+    means, groups = kmeans.groupMatrix(k, X[train], kmeans.closestClasses(X[train], kmeans.kMeansPlusPlus(k, X[train], rng)))[:2]
+    means = np.array(means)
+    majority = np.zeros((k, len(classes)), dtype=np.int64)
+    np.add.at(majority, (groups, labels[train]), 1)
+    majority = majority.argmax(axis=1)
+    assigned = kmeans.closestClasses(X[test], means)
+    sse = ((X[test] - means[assigned]) ** 2).sum(axis=1)
+    return {'sse': float(sse.mean()), 'purity': float(np.mean(majority[assigned] == labels[test]))}
+
+
+def peak_memory():
+    '''Peak resident set size of this process in bytes. It only grows, so
+    the growth measured around a fold is its peak memory only when the fold
+    runs in a fresh process.'''
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def run_fold(evaluate, test, options, X=None, y=None):
+    '''Evaluates one fold, training on every row not in ``test``. Without
+    ``X`` the matrices shared with the pool are used.
+    returns: metrics with the fold's wall-clock seconds and peak memory growth,
+             which is about 0 for a fold run after a larger one in the same
+             process'''
+    if X is None:
+        X = shared.get_array('X')
+        y = shared.get_array('y')
+    train = np.ones(X.shape[0], dtype=bool)
+    train[test] = False
+    train = np.flatnonzero(train)
+    memory = peak_memory()
+    start = time.time()
+    metrics = evaluate(X, y, train, test, **options)
+    metrics['time'] = time.time() - start
+    metrics['memory'] = peak_memory() - memory
+    return metrics
+
+
+def cross_validate(X, y, evaluate=c45_fold, k=10, processes=None, seed=None, **options):
+    '''Stratified ``k``-fold cross-validation of ``evaluate(X, y, train, test,
+    **options)``, which returns a dict of metrics. Folds are index arrays
+    over ``X`` and ``y``; with several processes they run in a pool sharing
+    both, each fold in a fresh worker so its peak memory is measured apart.
+    With ``processes=1`` the folds run in this process and 'memory' is
+    only meaningful for the first fold.
+    returns: {'folds': per-fold metrics, 'mean': ..., 'std': ...}'''
+    X = np.asarray(X, dtype=float)
+    y = np.asarray(y)
+    folds = stratified_folds(y, k, seed)
+    if processes == 1:
+        results = [run_fold(evaluate, test, options, X, y) for test in folds]
+    else:
+        pool = shared.pool(processes, maxtasksperchild=1, X=X, y=y)
+        try:
+            jobs = [pool.apply_async(run_fold, (evaluate, test, options)) for test in folds]
+            results = [job.get() for job in jobs]
+        except:
+            pool.terminate()
+            raise
+        pool.close()
+        pool.join()
+
+    for fold, (test, metrics) in enumerate(zip(folds, results)):
+        metrics['fold'] = fold
+        metrics['size'] = len(test)
+    names = sorted(name for name in results[0] if name not in ('fold', 'size'))
+    return {'folds': results,
+            'mean': dict((name, float(np.mean([m[name] for m in results]))) for name in names),
+            'std': dict((name, float(np.std([m[name] for m in results]))) for name in names)}
+
+
+if __name__ == '__main__':
+    parser = OptionParser(usage='%prog [options] data_file')
+    parser.add_option('-a', '--algorithm', dest='algorithm', default='c45', choices=['c45', 'kmeans'],
+                      help='c45 or kmeans (default c45)')
+    parser.add_option('-k', '--folds', dest='folds', type='int', default=10, help='Number of folds (default 10)')
+    parser.add_option('-p', '--processes', dest='processes', type='int', help='Processes running folds (default all CPUs); with 1 memory is measured for the first fold only')
+    parser.add_option('-s', '--seed', dest='seed', type='int', help='Seed of the folds')
+    (options, args) = parser.parse_args()
+
+    X, y = readMatrix(args[0])
+    evaluate = c45_fold if options.algorithm == 'c45' else kmeans_fold
+    result = cross_validate(X, y, evaluate, options.folds, options.processes, options.seed)
+    names = sorted(result['mean'])
+    print 'fold size ' + ' '.join(names)
+    for metrics in result['folds']:
+        print '%4d %4d ' % (metrics['fold'], metrics['size']) + ' '.join('%g' % metrics[name] for name in names)
+    print 'mean      ' + ' '.join('%g' % result['mean'][name] for name in names)
+    print 'std       ' + ' '.join('%g' % result['std'][name] for name in names)
@@ -0,0 +1,220 @@
+from collections import Counter
+from itertools import izip
+import numpy as np
+
+
+class GroupStatistics(object):
+    '''Count, sum, sum of squared differences from ``centers`` (zero by
+    default), minimum and maximum of every column in each of ``k`` groups.
+    Rows are added in chunks with ``update(X, labels)``, each chunk is
+    reduced with a few grouped numpy operations.'''
+
+    def __init__(self, k, p, centers=None):
+        self.k = k
+        self.p = p
+        self.centers = None if centers is None else np.asarray(centers, dtype=float)
+        self.counts = np.zeros(k, dtype=np.int64)
+        self.sums = np.zeros((k, p))
+        self.sq_sums = np.zeros((k, p))
+        self.mins = np.empty((k, p))
+        self.mins.fill(np.inf)
+        self.maxs = np.empty((k, p))
+        self.maxs.fill(-np.inf)
+
+    def update(self, X, labels):
+        X = np.asarray(X, dtype=float)
+        labels = np.asarray(labels, dtype=np.intp)
+        if X.shape[0] == 0:
+            return self
+
+        counts = np.bincount(labels, minlength=self.k)
+        self.counts += counts
+
+        D = X if self.centers is None else X - self.centers[labels]
+        D2 = D * D
+        for i in range(self.p):
+            self.sums[:, i] += np.bincount(labels, weights=X[:, i], minlength=self.k)
+            self.sq_sums[:, i] += np.bincount(labels, weights=D2[:, i], minlength=self.k)
+
+        # rows ordered by group, minimum and maximum reduced per group run
+        order = np.argsort(labels, kind='mergesort')
+        present = np.flatnonzero(counts)
+        starts = (np.cumsum(counts) - counts)[present]
+        sorted_X = X[order]
+        self.mins[present] = np.minimum(self.mins[present], np.minimum.reduceat(sorted_X, starts, axis=0))
+        self.maxs[present] = np.maximum(self.maxs[present], np.maximum.reduceat(sorted_X, starts, axis=0))
+        return self
+
+    def grow(self, k):
+        '''Adds empty groups so that there are ``k`` of them.'''
+        extra = k - self.k
+        if extra <= 0:
+            return self
+        self.counts = np.concatenate([self.counts, np.zeros(extra, dtype=np.int64)])
+        self.sums = np.vstack([self.sums, np.zeros((extra, self.p))])
+        self.sq_sums = np.vstack([self.sq_sums, np.zeros((extra, self.p))])
+        self.mins = np.vstack([self.mins, np.empty((extra, self.p))])
+        self.mins[self.k:] = np.inf
+        self.maxs = np.vstack([self.maxs, np.empty((extra, self.p))])
+        self.maxs[self.k:] = -np.inf
+        self.k = k
+        return self
+
+    def merge(self, other):
+        '''Adds statistics of ``other``, accumulated around the same centers.'''
+        self.grow(other.k)
+        k = other.k
+        self.counts[:k] += other.counts
+        self.sums[:k] += other.sums
+        self.sq_sums[:k] += other.sq_sums
+        self.mins[:k] = np.minimum(self.mins[:k], other.mins)
+        self.maxs[:k] = np.maximum(self.maxs[:k], other.maxs)
+        return self
+
+    def raw_sq_sums(self):
+        '''Sums of squares around zero.'''
+        if self.centers is None:
+            return self.sq_sums.copy()
+        centers = np.where(self.counts[:, np.newaxis] > 0, self.centers, 0.0)
+        return self.sq_sums + centers * (2 * self.sums - self.counts[:, np.newaxis] * centers)
+
+    def means(self):
+        return self.sums / self.counts[:, np.newaxis]
+
+    def variances(self, ddof=0):
+        '''Mean squared difference from the centers; with ``ddof=1`` the
+        sum is divided by count - 1. Groups with no more than ``ddof`` rows
+        have variances 0.'''
+        return self.sq_sums / np.maximum(self.counts[:, np.newaxis] - ddof, 1).astype(float)
+
+
+def group_statistics(X, labels, k, centers=None, block_size=65536):
+    '''Statistics of the rows of ``X`` grouped by integer ``labels``,
+    reduced ``block_size`` rows at a time.'''
+    stats = GroupStatistics(k, X.shape[1], centers)
+    for start in xrange(0, X.shape[0], block_size):
+        stats.update(X[start:start + block_size], labels[start:start + block_size])
+    return stats
+
+
+class Moments(object):
+    '''Count, mean and sum of squared differences from the mean of every
+    column. Rows are added in chunks with ``update(X)``; the moments of a
+    chunk are merged into the running ones (Chan, Golub, LeVeque 1979),
+    which stays accurate when the mean is large compared with the
+    deviation, unlike a sum of squares.'''
+
+    def __init__(self, p):
+        self.p = p
+        self.count = 0
+        self.mean = np.zeros(p)
+        self.m2 = np.zeros(p)
+
+    def update(self, X):
+        X = np.asarray(X, dtype=float).reshape(-1, self.p)
+        n = X.shape[0]
+        if n == 0:
+            return self
+        mean = X.mean(axis=0)
+        m2 = ((X - mean) ** 2).sum(axis=0)
+        total = self.count + n
+        delta = mean - self.mean
+        self.mean = self.mean + delta * (float(n) / total)
+        self.m2 = self.m2 + m2 + delta ** 2 * (float(self.count) * n / total)
+        self.count = total
+        return self
+
+    def variances(self, ddof=0):
+        return self.m2 / float(self.count - ddof)
+
+
+class QuantileSketch(object):
+    '''Values summarised by centroids, the means and counts of runs of
+    sorted values (a merging t-digest with a uniform scale). Values are
+    added in chunks with ``update(values)``, sketches of parts of the data
+    can be merged. While there are no more than ``exact_size`` distinct
+    values (always without ``error``) they are counted in a Counter and
+    quantiles are exact; past that a run holds about ``error`` of all
+    values, so there are about 1 / ``error`` centroids and a quantile is
+    off by about ``error`` in rank.'''
+
+    def __init__(self, error=None, exact_size=100000):
+        self.error = error
+        self.exact_size = exact_size
+        self.count = 0
+        self.exact = Counter() # count of every value while exact, None after
+        self.ordered = True    # means and counts hold the exact counts sorted
+        self.means = np.zeros(0)
+        self.counts = np.zeros(0, dtype=np.int64)
+
+    def update(self, values):
+        values = np.asarray(values, dtype=float).ravel()
+        if self.exact is None:
+            return self._add(values, np.ones(len(values), dtype=np.int64))
+        distinct, counts = np.unique(values, return_counts=True)
+        return self._count(izip(distinct.tolist(), counts.tolist()), len(values))
+
+    def merge(self, other):
+        '''Adds the values summarised by ``other``.'''
+        if self.exact is not None and other.exact is not None:
+            return self._count(other.exact.iteritems(), other.count)
+        means, counts = other.centroids()
+        if self.exact is not None:
+            self._leave_exact()
+        return self._add(means, counts)
+
+    def centroids(self):
+        '''Sorted centroid means and counts, sorted once after updates while
+        the values are counted exactly.'''
+        if self.exact is not None and not self.ordered:
+            values = sorted(self.exact.iteritems())
+            self.means = np.array([value for value, count in values], dtype=float)
+            self.counts = np.array([count for value, count in values], dtype=np.int64)
+            self.ordered = True
+        return self.means, self.counts
+
+    def _count(self, counts, total):
+        self.exact.update(dict(counts))
+        self.count += total
+        self.ordered = False
+        if self.error and len(self.exact) > self.exact_size:
+            self._leave_exact()
+        return self
+
+    def _leave_exact(self):
+        means, counts = self.centroids()
+        self.exact = None
+        self.means = np.zeros(0)
+        self.counts = np.zeros(0, dtype=np.int64)
+        self._add(means, counts)
+
+    def _add(self, means, counts):
+        means = np.concatenate([self.means, means])
+        counts = np.concatenate([self.counts, counts])
+        order = np.argsort(means, kind='mergesort')
+        means, counts = means[order], counts[order]
+        self.count = int(counts.sum())
+        if not len(means):
+            return self
+
+        if self.error:
+            # centroids whose middle ranks fall in the same error-sized span are joined
+            keys = np.floor((np.cumsum(counts) - counts / 2.0) / (self.error * self.count))
+        else:
+            keys = means
+        starts = np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1])))
+        self.counts = np.add.reduceat(counts, starts)
+        if self.error:
+            self.means = np.add.reduceat(means * counts, starts) / self.counts
+        else:
+            self.means = means[starts]
+        return self
+
+    def value_above(self, rank):
+        '''The first value (centroid mean) at which the count of values up to
+        it exceeds ``rank``, None if there is none.'''
+        means, counts = self.centroids()
+        i = np.searchsorted(np.cumsum(counts), rank, side='right')
+        if i == len(means):
+            return None
+        return float(means[i])
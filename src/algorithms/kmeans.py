@@ -7,9 +7,14 @@ import csv
 import shutil
 import os
 import os.path
+from itertools import izip, islice
+from multiprocessing import cpu_count
 
 from optparse import OptionParser
 
+import shared
+from grouped import GroupStatistics, group_statistics
+
 class UnsupervisedKMeans:
     fileIdx = -1
 
@@ -202,44 +207,25 @@ class UnsupervisedKMeans:
         # compute inter
         inter = self.computeInter(means)
     
-        iFile = open(oFileName, 'rb')
-        reader = csv.reader(iFile, delimiter=',', quotechar='"')
-    
-        p = means[0].shape[0] # dimensionality
-    
-        minVals = [[None for i in range(p)] for j in range(k)] # minimum attribute vals in each group
-        maxVals = [[None for i in range(p)] for j in range(k)] # maximum attribute vals in each group
-        sig = [np.zeros(p) for i in range(k)] # attribute variances in each group
-    
-        sizes = [0] * k # sizes of all groups
-        intra = 0
-    
-        for row in reader:
-            cls = int(row[-1])
-            sizes[cls] += 1
-    
-            intra += sum([d**2 for d in means[cls] - np.array(map(float, row[0:-1]))]) # squared Euclidian norm
-    
-            for i in range(p):
-                val = float(row[i])
-    
-                # minimal feature value
-                if minVals[cls][i] == None or val < minVals[cls][i]:
-                    minVals[cls][i] = val
-    
-                # maximal feature value
-                if maxVals[cls][i] == None or val > maxVals[cls][i]:
-                    maxVals[cls][i] = val
-                
-                # feature variances
-                sig[cls][i] += (val - means[cls][i])**2
-        iFile.close()
-    
-        # complete variances calculation
-        sig = [sig[cls]/float(sizes[cls] - 1) for cls in range(k)]
+        stats = GroupStatistics(k, means[0].shape[0], means)
+        for rows, X in self.readChunks(oFileName, self.batchSize):
+            stats.update(X[:, :-1], X[:, -1].astype(np.intp))
+        intra, minVals, maxVals, sig = self.summarise(stats)
     
         return (means, oFileName, inter, intra, minVals, maxVals, sig)
     
+    lastStats = None # GroupStatistics of the last grouping
+
+    def summarise(self, stats):
+        ''' Converts GroupStatistics around the group means to
+            (intra, minVals, maxVals, sig) as returned by group() '''
+        self.lastStats = stats
+        intra = stats.sq_sums.sum()
+        minVals = [[None] * stats.p if stats.counts[cls] == 0 else list(stats.mins[cls]) for cls in range(stats.k)]
+        maxVals = [[None] * stats.p if stats.counts[cls] == 0 else list(stats.maxs[cls]) for cls in range(stats.k)]
+        sig = list(stats.variances(ddof=1))
+        return intra, minVals, maxVals, sig
+
     def divideMean(self, baseMean, clsMinVals, clsMaxVals):
         ''' baseMean - np.array
             clsMinVals - list
@@ -253,29 +239,673 @@ class UnsupervisedKMeans:
         minusMean = baseMean - np.array(a)
         plusMean = baseMean + np.array(a)
         return minusMean, plusMean
-    
-    def run(self, maxK, iFileName, oDir):
+
+    def chooseSplitClass(self, k, sig):
+        ''' Returns the class with largest average attribute variance '''
+        maxSig = None
+        splitCls = None
+        for cls in range(k):
+            avgSig = np.average(sig[cls])
+            if maxSig == None or avgSig > maxSig:
+                maxSig = avgSig
+                splitCls = cls
+        return splitCls
+
+    # In-memory engine: the same algorithm as above, but vectors are read
+    # once into a float matrix and classes are kept in an integer array.
+
+    blockSize = 65536 # rows processed at once when computing distances
+
+    def loadMatrix(self, iFileName):
+        ''' Reads vectors in iFileName into a contiguous n x p matrix '''
+        return np.loadtxt(iFileName, delimiter=',', ndmin=2)
+
+    def randomClasses(self, k, n):
+        ''' Array analogue of assignRandomClasses (same random sequence) '''
+        return np.array([randint(0, k - 1) for i in xrange(n)], dtype=np.intp)
+
+    def computeMatrixMeans(self, k, X, labels):
+        ''' Returns k x p matrix of group means '''
+        sizes = np.bincount(labels, minlength=k)
+        sums = np.empty((k, X.shape[1]))
+        for i in range(X.shape[1]):
+            sums[:, i] = np.bincount(labels, weights=X[:, i], minlength=k)
+        with np.errstate(invalid='ignore'): # the mean of an empty group is NaN
+            return sums / sizes[:, np.newaxis].astype(float)
+
+    def closestClasses(self, X, means):
+        ''' Returns array of the closest mean index for every row of X '''
+        labels = np.empty(X.shape[0], dtype=np.intp)
+        for start in xrange(0, X.shape[0], self.blockSize):
+            block = X[start:start + self.blockSize]
+            minD = np.empty(block.shape[0])
+            minD.fill(np.inf)
+            bestCls = np.zeros(block.shape[0], dtype=np.intp)
+            for cls in range(len(means)):
+                if not np.isfinite(means[cls]).all(): # mean of an empty group
+                    continue
+                d = ((block - means[cls]) ** 2).sum(axis=1)
+                closer = d < minD
+                minD[closer] = d[closer]
+                bestCls[closer] = cls
+            labels[start:start + block.shape[0]] = bestCls
+        return labels
+
+    def reassignClasses(self, X, means, labels):
+        ''' Moves every row of X to the class of its closest mean, updating
+            labels in place a block at a time
+            returns: number of moved rows '''
+        nMoved = 0
+        for start in xrange(0, X.shape[0], self.blockSize):
+            block = self.closestClasses(X[start:start + self.blockSize], means)
+            old = labels[start:start + block.shape[0]]
+            nMoved += np.count_nonzero(block != old)
+            old[:] = block
+        return nMoved
+
+    # Hamerly's bounds: for every vector an upper bound of the distance to
+    # its own mean and a lower bound of the distance to any other mean are
+    # kept between iterations and moved by the drift of the means, so
+    # distances are computed only for vectors whose class may change.
+
+    useBounds = False # use bounds when assigning classes in memory mode
+    computedDistances = 0 # distance evaluations made with bounds in use
+    skippedDistances = 0 # distance evaluations saved by the bounds
+
+    def boundedClasses(self, X, means, labels, oldMeans=None, upper=None, lower=None):
+        ''' Returns the same classes as closestClasses(X, means) and updated
+            bounds (labels, upper, lower); all bounds are computed when
+            upper is None. Means of empty groups (NaN) are infinitely far
+            away, as in closestClasses '''
+        n, k = X.shape[0], means.shape[0]
+        labels = labels.copy()
+        finite = np.isfinite(means).all(axis=1)
+        computed = 0
+        if upper is None:
+            rows = np.arange(n)
+            upper = np.empty(n)
+            lower = np.empty(n)
+        else:
+            # an empty group stays empty, so its mean does not drift
+            drift = np.zeros(k)
+            moved = finite & np.isfinite(oldMeans).all(axis=1)
+            drift[moved] = np.sqrt(((means[moved] - oldMeans[moved]) ** 2).sum(axis=1))
+            upper = upper + drift[labels]
+            order = np.argsort(drift)
+            lower = lower - np.where(labels == order[-1], drift[order[-2]], drift[order[-1]])
+
+            centerD = np.empty((k, k))
+            centerD.fill(np.inf)
+            centerD[np.ix_(finite, finite)] = np.sqrt(((means[finite, np.newaxis, :] -
+                                                         means[np.newaxis, finite, :]) ** 2).sum(axis=2))
+            centerD[np.diag_indices(k)] = np.inf
+            bound = np.maximum(0.5 * centerD.min(axis=1)[labels], lower)
+
+            rows = np.flatnonzero(upper > bound)
+            upper[rows] = np.sqrt(((X[rows] - means[labels[rows]]) ** 2).sum(axis=1))
+            computed += rows.shape[0]
+            rows = rows[upper[rows] > bound[rows]]
+
+        for start in xrange(0, rows.shape[0], self.blockSize):
+            block = rows[start:start + self.blockSize]
+            d = np.empty((block.shape[0], k))
+            for cls in range(k):
+                d[:, cls] = ((X[block] - means[cls]) ** 2).sum(axis=1) if finite[cls] else np.inf
+            labels[block] = d.argmin(axis=1)
+            d.partition(1, axis=1)
+            upper[block] = np.sqrt(d[:, 0])
+            lower[block] = np.sqrt(d[:, 1])
+        computed += rows.shape[0] * k
+
+        self.computedDistances += computed
+        self.skippedDistances += n * k - computed
+        return labels, upper, lower
+
+    def groupMatrix(self, k, X, labels, means=None):
+        ''' In-memory analogue of group(); labels are updated in place. If
+            means are given, labels are already consistent with them and no
+            reassignment is done
+            returns: (means, labels, inter, intra, minVals, maxVals, sig)'''
+        upper = lower = None
+        for it in range(0 if means is not None else 100):
+            oldMeans = means
+            means = self.computeMatrixMeans(k, X, labels)
+            if self.useBounds:
+                newLabels, upper, lower = self.boundedClasses(X, means, labels, oldMeans, upper, lower)
+                nMoved = np.count_nonzero(newLabels != labels)
+                labels[:] = newLabels
+            else:
+                nMoved = self.reassignClasses(X, means, labels)
+            if nMoved == 0: # nothing changed; means are consistent with class assignments
+                break
+
+        means = list(means)
+        inter = self.computeInter(means)
+
+        intra, minVals, maxVals, sig = self.summarise(group_statistics(X, labels, k, means, self.blockSize))
+
+        return (means, labels, inter, intra, minVals, maxVals, sig)
+
+    # Local splitting: after a group is split in two, only its vectors and
+    # the vectors of its nearest groups are re-clustered. The other means do
+    # not move, so the other vectors are checked against the moved means
+    # only, and a global grouping is needed only if some of them would move.
+
+    localSplit = False # re-cluster only around the split group in memory mode
+    splitNeighbours = 2 # nearest groups re-clustered with the split one
+    localPasses = 20 # maximum number of local re-clustering passes
+
+    def membership(self, k, labels):
+        ''' Returns index of the vectors in every class: {cls: rows} '''
+        counts = np.bincount(labels, minlength=k)
+        order = np.argsort(labels, kind='mergesort')
+        ends = np.cumsum(counts)
+        return dict((cls, order[ends[cls] - counts[cls]:ends[cls]]) for cls in range(k))
+
+    def splitLocally(self, X, labels, means, splitCls):
+        ''' Classes for the means of the next k, where means[:-2] are the
+            means of the groups except splitCls and means[-2:] replace it;
+            labels are updated in place
+            returns: (labels, means) - means is None unless the local
+                     re-clustering is known to be consistent for all vectors'''
+        k = len(means)
+        means = np.array(means)
+        split = labels == splitCls
+        labels -= labels > splitCls
+        labels[split] = k - 2
+
+        baseMean = 0.5 * (means[-2] + means[-1])
+        d = ((means[:-2] - baseMean) ** 2).sum(axis=1)
+        active = list(np.argsort(d)[:self.splitNeighbours]) + [k - 2, k - 1]
+        index = self.membership(k, labels)
+        rows = np.concatenate([index[cls] for cls in active])
+
+        sub = X[rows]
+        activeMeans = means[active]
+        for it in range(self.localPasses):
+            local = self.closestClasses(sub, activeMeans)
+            moved = np.count_nonzero(np.take(active, local) != labels[rows])
+            labels[rows] = np.take(active, local)
+            activeMeans = self.computeMatrixMeans(len(active), sub, local)
+            if moved == 0:
+                break
+        means[active] = activeMeans
+        if moved != 0 or np.isnan(activeMeans).any():
+            return labels, None
+
+        # vectors outside the active groups move only to a moved mean
+        others = np.ones(X.shape[0], dtype=bool)
+        others[rows] = False
+        others = np.flatnonzero(others)
+        if others.shape[0]:
+            own = ((X[others] - means[labels[others]]) ** 2).sum(axis=1)
+            closest = np.take(active, self.closestClasses(X[others], activeMeans))
+            dActive = ((X[others] - means[closest]) ** 2).sum(axis=1)
+            # ties go to the smaller class, as in closestClasses
+            if (dActive < own).any() or ((dActive == own) & (closest < labels[others])).any():
+                return labels, None
+        if (self.closestClasses(sub, means) != labels[rows]).any():
+            return labels, None
+        return labels, means
+
+    def writeClasses(self, iFileName, labels, oFileName):
+        ''' Writes vectors of iFileName with their classes appended '''
+        iFile = open(iFileName, 'rb')
+        oFile = open(oFileName, 'wb')
+        reader = csv.reader(iFile, delimiter=',', quotechar='"')
+        writer = csv.writer(oFile, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+        for row, cls in izip(reader, labels):
+            row.append(int(cls))
+            writer.writerow(row)
+        iFile.close()
+        oFile.close()
+
+    # Seeding and restarts of the in-memory engine: the k = 2 grouping the
+    # sweep starts from is either random or seeded with k-means++; nInit
+    # sweeps with different seeds are run in a process pool and the grouping
+    # with the smallest intra is kept for every k.
+
+    init = 'random' # 'random' or 'k-means++'
+    nInit = 1 # number of independently seeded sweeps
+    nWorkers = None # processes for the sweeps (default: number of CPUs)
+    seed = None # seed of the sweeps; numpy.random state is used if None
+
+    def kMeansPlusPlus(self, k, X, rng):
+        ''' Returns k means chosen from X with probability proportional to
+            the squared distance to the closest already chosen mean '''
+        n = X.shape[0]
+        means = [X[rng.randint(n)].copy()]
+        d = ((X - means[0]) ** 2).sum(axis=1)
+        for i in range(1, k):
+            idx = np.searchsorted(np.cumsum(d), rng.random_sample() * d.sum())
+            means.append(X[min(idx, n - 1)].copy())
+            d = np.minimum(d, ((X - means[-1]) ** 2).sum(axis=1))
+        return means
+
+    def initialClasses(self, X, rng=None):
+        ''' Classes of the k = 2 grouping the sweep starts from '''
+        if self.init == 'k-means++':
+            return self.closestClasses(X, self.kMeansPlusPlus(2, X, rng or np.random))
+        if rng is None:
+            return self.randomClasses(2, X.shape[0])
+        return rng.randint(0, 2, X.shape[0]).astype(np.intp)
+
+    def sweepMatrix(self, maxK, X, labels, iFileName, oDir, mode=None, checkpoint=None):
+        ''' Groups X into k = 2, ..., maxK groups writing k<N> files to oDir;
+            checkpoints are written if mode is given, and the sweep continues
+            from checkpoint if one is given
+            returns: bestK, bestRatio, {k: (intra, inter)}'''
+        bestRatio = None
+        bestK = None
+        scores = {}
+        means = None
+        firstK = 2
+        if checkpoint is not None:
+            firstK = checkpoint['k']
+            bestK, bestRatio, means = checkpoint['bestK'], checkpoint['bestRatio'], checkpoint['means']
+        for k in range(firstK, maxK + 1):
+            means, labels, inter, intra, minVals, maxVals, sig = self.groupMatrix(k, X, labels, means)
+
+            self.writeClasses(iFileName, labels, oDir + '/k' + str(k))
+            self.saveModel(oDir + '/k' + str(k) + '.model', self.lastStats)
+            scores[k] = (intra, inter)
+
+            ratio = float(intra)/inter
+            if bestRatio == None or ratio < bestRatio:
+                bestRatio = ratio
+                bestK = k
+
+            # splitting for the next k
+            splitCls = self.chooseSplitClass(k, sig)
+            minusMean, plusMean = self.divideMean(means[splitCls], minVals[splitCls], maxVals[splitCls])
+            del means[splitCls]
+            means.append(minusMean)
+            means.append(plusMean)
+            if self.localSplit:
+                labels, means = self.splitLocally(X, labels, means, splitCls)
+            else:
+                self.reassignClasses(X, means, labels)
+                means = None
+            if mode is not None:
+                self.saveCheckpoint(oDir, mode, iFileName, k + 1, means, bestK, bestRatio, labels)
+
+        if mode is not None:
+            self.removeCheckpoint(oDir)
+        return bestK, bestRatio, scores
+
+    def runRestarts(self, maxK, X, iFileName, oDir):
+        ''' Runs nInit seeded sweeps in a process pool sharing X and keeps
+            the grouping with the smallest intra for every k '''
+        if self.seed is None:
+            seeds = np.random.randint(2**31 - 1, size=self.nInit)
+        else:
+            seeds = np.random.RandomState(self.seed).randint(2**31 - 1, size=self.nInit)
+
+        if not os.path.exists(self.tmpDir):
+            os.makedirs(self.tmpDir)
+        processes = min(self.nInit, self.nWorkers or cpu_count())
+        if isinstance(X, np.memmap):
+            # workers map the same file, pages are shared by the OS
+            pool = shared.pool(processes)
+            matrix = (X.filename, X.shape)
+        else:
+            pool = shared.pool(processes, X=X)
+            matrix = None
+        jobs = []
+        for i, restartSeed in enumerate(seeds):
+            restartDir = self.tmpDir + '/restart' + str(i)
+            jobs.append((restartDir, pool.apply_async(runRestart,
+                         (self, maxK, int(restartSeed), iFileName, restartDir, matrix))))
+        restarts = []
+        for restartDir, job in jobs:
+            scores, computed, skipped = job.get()
+            restarts.append((restartDir, scores))
+            self.computedDistances += computed
+            self.skippedDistances += skipped
+        pool.close()
+        pool.join()
+
+        bestRatio = None
+        bestK = None
+        for k in range(2, maxK + 1):
+            restartDir, (intra, inter) = min([(restartDir, scores[k]) for restartDir, scores in restarts],
+                                             key=lambda restart: restart[1][0])
+            shutil.copy(restartDir + '/k' + str(k), oDir + '/k' + str(k))
+            shutil.copy(restartDir + '/k' + str(k) + '.model', oDir + '/k' + str(k) + '.model')
+            ratio = float(intra)/inter
+            if bestRatio == None or ratio < bestRatio:
+                bestRatio = ratio
+                bestK = k
+
+        shutil.rmtree(self.tmpDir)
+
+        return bestK, bestRatio
+
+    # Memory-mapped storage: vectors are converted once into a binary
+    # float64 file in tmpDir and classes are kept in an int32 file updated
+    # in place, so both are paged in by the OS instead of being held in
+    # process memory and only the final k<N> files are written as CSV.
+
+    def mapClasses(self, n):
+        ''' Returns memory-mapped int32 class array in tmpDir '''
+        return np.memmap(self.tmpDir + '/classes.i32', dtype=np.int32, mode='w+', shape=(n,))
+
+    def mapMatrix(self, iFileName):
+        ''' Writes vectors of iFileName to tmpDir as a binary float64
+            matrix and returns it memory-mapped '''
+        fileName = self.tmpDir + '/vectors.f64'
+        oFile = open(fileName, 'wb')
+        n = 0
+        for rows, X in self.readChunks(iFileName, self.batchSize):
+            X.tofile(oFile)
+            n += X.shape[0]
+            p = X.shape[1]
+        oFile.close()
+        if not n:
+            raise ValueError('%s has no vectors' % iFileName)
+        return np.memmap(fileName, dtype=np.float64, mode='r', shape=(n, p))
+
+    def runInMemory(self, maxK, iFileName, oDir, mapped=False, resume=False):
+        ''' run() with the in-memory engine; vectors are memory-mapped from
+            tmpDir if mapped is set. Restarts (nInit > 1) are not
+            checkpointed, so they cannot be resumed '''
+        if resume and self.nInit > 1:
+            raise ValueError('resume is not supported with nInit > 1')
+        if not os.path.exists(oDir):
+            os.makedirs(oDir)
+
+        if mapped:
+            if not os.path.exists(self.tmpDir):
+                os.makedirs(self.tmpDir)
+            X = self.mapMatrix(iFileName)
+        else:
+            X = self.loadMatrix(iFileName)
+        self.computedDistances = 0
+        self.skippedDistances = 0
+        if self.nInit > 1:
+            return self.runRestarts(maxK, X, iFileName, oDir)
+
+        mode = 'memmap' if mapped else 'memory'
+        checkpoint = self.loadCheckpoint(oDir, mode, iFileName) if resume else None
+        if checkpoint is not None:
+            labels = checkpoint['labels']
+        else:
+            rng = None
+            if self.seed is not None:
+                rng = np.random.RandomState(self.seed)
+            labels = self.initialClasses(X, rng)
+        if mapped:
+            labelFile = self.mapClasses(X.shape[0])
+            labelFile[:] = labels
+            labels = labelFile
+        else:
+            labels = labels.astype(np.int32)
+        bestK, bestRatio, scores = self.sweepMatrix(maxK, X, labels, iFileName, oDir, mode, checkpoint)
+
+        if mapped:
+            del X, labels
+            shutil.rmtree(self.tmpDir)
+
+        return bestK, bestRatio
+
+    # Mini-batch engine: vectors are streamed in chunks of batchSize rows,
+    # so memory does not depend on the number of rows in the input file.
+
+    batchSize = 10000 # rows in one mini-batch
+    batchPasses = 3 # maximum number of passes over the file for each k
+    batchTolerance = 1e-4 # stop passing when means move less than this
+
+    def readChunks(self, iFileName, size):
+        ''' Yields (rows, X): lists of CSV rows and their float matrices '''
+        iFile = open(iFileName, 'rb')
+        reader = csv.reader(iFile, delimiter=',', quotechar='"')
+        while True:
+            rows = list(islice(reader, size))
+            if not rows:
+                break
+            yield rows, np.array(rows, dtype=float)
+        iFile.close()
+
+    def initialBatchMeans(self, k, iFileName):
+        ''' Initial means chosen from the first mini-batch '''
+        rows, X = next(self.readChunks(iFileName, self.batchSize))
+        if self.init == 'k-means++':
+            rng = np.random if self.seed is None else np.random.RandomState(self.seed)
+            return self.kMeansPlusPlus(k, X, rng)
+        labels = self.randomClasses(k, X.shape[0])
+        return list(self.computeMatrixMeans(k, X, labels))
+
+    def updateBatchMeans(self, k, iFileName, means):
+        ''' Passes over iFileName moving every mean towards the average of the
+            vectors assigned to it so far '''
+        means = np.array(means)
+        for it in range(self.batchPasses):
+            previous = means.copy()
+            counts = np.zeros(k)
+            for rows, X in self.readChunks(iFileName, self.batchSize):
+                labels = self.closestClasses(X, means)
+                sizes = np.bincount(labels, minlength=k)
+                counts += sizes
+                for cls in np.flatnonzero(sizes):
+                    batchSum = X[labels == cls].sum(axis=0)
+                    means[cls] += (batchSum - sizes[cls] * means[cls]) / counts[cls]
+            if np.abs(means - previous).max() < self.batchTolerance:
+                break
+        return list(means)
+
+    def writeBatchGroups(self, k, iFileName, means, oFileName):
+        ''' Writes vectors classified by their closest mean and collects
+            the same statistics as group()
+            returns: (inter, intra, minVals, maxVals, sig)'''
+        oFile = open(oFileName, 'wb')
+        writer = csv.writer(oFile, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+
+        stats = GroupStatistics(k, means[0].shape[0], means)
+        for rows, X in self.readChunks(iFileName, self.batchSize):
+            labels = self.closestClasses(X, means)
+            for row, cls in izip(rows, labels):
+                row.append(int(cls))
+            writer.writerows(rows)
+            stats.update(X, labels)
+        oFile.close()
+
+        intra, minVals, maxVals, sig = self.summarise(stats)
+        return self.computeInter(list(means)), intra, minVals, maxVals, sig
+
+    def runMiniBatch(self, maxK, iFileName, oDir, resume=False):
+        ''' run() with the mini-batch engine '''
+        if not os.path.exists(oDir):
+            os.makedirs(oDir)
+
+        checkpoint = self.loadCheckpoint(oDir, 'minibatch', iFileName) if resume else None
+        if checkpoint is not None:
+            firstK = checkpoint['k']
+            means, bestK, bestRatio = checkpoint['means'], checkpoint['bestK'], checkpoint['bestRatio']
+        else:
+            firstK = 2
+            means = self.initialBatchMeans(2, iFileName)
+            bestRatio = None
+            bestK = None
+        for k in range(firstK, maxK + 1):
+            means = self.updateBatchMeans(k, iFileName, means)
+            inter, intra, minVals, maxVals, sig = self.writeBatchGroups(k, iFileName, means, oDir + '/k' + str(k))
+            self.saveModel(oDir + '/k' + str(k) + '.model', self.lastStats)
+
+            ratio = float(intra)/inter
+            if bestRatio == None or ratio < bestRatio:
+                bestRatio = ratio
+                bestK = k
+
+            # splitting for the next k
+            splitCls = self.chooseSplitClass(k, sig)
+            minusMean, plusMean = self.divideMean(means[splitCls], minVals[splitCls], maxVals[splitCls])
+            del means[splitCls]
+            means.append(minusMean)
+            means.append(plusMean)
+            self.saveCheckpoint(oDir, 'minibatch', iFileName, k + 1, means, bestK, bestRatio)
+
+        self.removeCheckpoint(oDir)
+        return bestK, bestRatio
+
+    # Fitted models: every k<N> file gets a k<N>.model file next to it with
+    # the means and per-group sufficient statistics (count, sum, sum of
+    # squares, minimum, maximum), so appended vectors can be grouped
+    # without running the whole sweep again.
+
+    def saveModel(self, fileName, stats):
+        ''' Writes GroupStatistics of a grouping as a compact .npz file '''
+        counts = stats.counts[:, np.newaxis]
+        means = np.where(counts > 0, stats.sums / np.maximum(counts, 1), np.nan)
+        mFile = open(fileName, 'wb')
+        np.savez(mFile, means=means, counts=stats.counts, sums=stats.sums,
+                 sqSums=stats.raw_sq_sums(), minVals=stats.mins, maxVals=stats.maxs)
+        mFile.close()
+
+    def loadModel(self, fileName):
+        ''' Returns GroupStatistics (around zero) saved by saveModel '''
+        model = np.load(fileName)
+        stats = GroupStatistics(model['counts'].shape[0], model['sums'].shape[1])
+        stats.counts[:] = model['counts']
+        stats.sums[:] = model['sums']
+        stats.sq_sums[:] = model['sqSums']
+        stats.mins[:] = model['minVals']
+        stats.maxs[:] = model['maxVals']
+        model.close()
+        return stats
+
+    def partialFit(self, k, iFileName, oDir, passes=0):
+        ''' Groups new vectors of iFileName with the model of oDir/k<N>:
+            new vectors are assigned to the closest means, the means are
+            updated and the vectors are appended to oDir/k<N>. With passes
+            > 0 the new vectors are reassigned to the updated means at most
+            passes times; vectors grouped before keep their classes.
+            returns: means - updated group means'''
+        modelFileName = oDir + '/k' + str(k) + '.model'
+        base = self.loadModel(modelFileName)
+        X = self.loadMatrix(iFileName)
+
+        means = base.means()
+        labels = self.closestClasses(X, means)
+        for it in range(passes + 1):
+            stats = GroupStatistics(k, X.shape[1]).merge(base)
+            stats.update(X, labels)
+            counts = stats.counts[:, np.newaxis]
+            means = np.where(counts > 0, stats.sums / np.maximum(counts, 1), means)
+            if it == passes:
+                break
+            newLabels = self.closestClasses(X, means)
+            if (newLabels == labels).all():
+                break
+            labels = newLabels
+
+        oFile = open(oDir + '/k' + str(k), 'ab')
+        iFile = open(iFileName, 'rb')
+        reader = csv.reader(iFile, delimiter=',', quotechar='"')
+        writer = csv.writer(oFile, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+        for row, cls in izip(reader, labels):
+            row.append(int(cls))
+            writer.writerow(row)
+        iFile.close()
+        oFile.close()
+
+        self.saveModel(modelFileName, stats)
+        return list(means)
+
+    # Checkpoints: after every checkpointEvery values of k the state needed
+    # to continue the sweep (next k, its means and classes, best k and ratio
+    # so far) is written to oDir/kmeans.checkpoint, so that run(...,
+    # resume=True) continues from the last completed k.
+
+    checkpointEvery = 1 # values of k between checkpoints (0 - no checkpoints)
+
+    def checkpointFileName(self, oDir):
+        return oDir + '/kmeans.checkpoint'
+
+    def saveCheckpoint(self, oDir, mode, iFileName, k, means, bestK, bestRatio, labels=None):
+        ''' Writes the state for continuing the sweep from k; the file is
+            written aside and renamed, so a checkpoint is never partial '''
+        if not self.checkpointEvery or (k - 3) % self.checkpointEvery:
+            return
+        fileName = self.checkpointFileName(oDir)
+        cFile = open(fileName + '.tmp', 'wb')
+        np.savez(cFile, mode=mode, iFileName=iFileName, k=k, bestK=bestK, bestRatio=bestRatio,
+                 means=np.zeros((0, 0)) if means is None else np.array(means),
+                 labels=np.zeros(0, dtype=np.int32) if labels is None else np.asarray(labels, dtype=np.int32))
+        cFile.flush()
+        os.fsync(cFile.fileno())
+        cFile.close()
+        os.rename(fileName + '.tmp', fileName)
+
+    def loadCheckpoint(self, oDir, mode, iFileName):
+        ''' Returns the state saved by saveCheckpoint for the same mode and
+            input file, or None '''
+        fileName = self.checkpointFileName(oDir)
+        if not os.path.exists(fileName):
+            return None
+        state = np.load(fileName)
+        if str(state['mode']) != mode or str(state['iFileName']) != iFileName:
+            return None
+        checkpoint = {
+            'k': int(state['k']),
+            'bestK': int(state['bestK']),
+            'bestRatio': float(state['bestRatio']),
+            'means': list(state['means']) if state['means'].size else None,
+            'labels': state['labels'] if state['labels'].size else None,
+        }
+        state.close()
+        return checkpoint
+
+    def removeCheckpoint(self, oDir):
+        if os.path.exists(self.checkpointFileName(oDir)):
+            os.remove(self.checkpointFileName(oDir))
+
+    def run(self, maxK, iFileName, oDir, mode='csv', resume=False):
         ''' Splits vectors in iFile into maximum maxK groups
+            mode:
+                csv - intermediate groupings are kept in CSV files in tmpDir
+                memory - vectors are loaded once into a matrix
+                memmap - as memory, but the matrix and classes are binary
+                         files in tmpDir mapped into memory
+                minibatch - vectors are streamed in chunks of batchSize rows
+            resume - continue from the checkpoint in oDir, if there is one;
+                     not with nInit > 1 in memory and memmap modes
             returns:
                 bestK - best number of groups
                 files with splits into k= 1,...,kMax groups in oDir'''
-    
+
+        if mode == 'memory':
+            return self.runInMemory(maxK, iFileName, oDir, resume=resume)
+        if mode == 'memmap':
+            return self.runInMemory(maxK, iFileName, oDir, mapped=True, resume=resume)
+        if mode == 'minibatch':
+            return self.runMiniBatch(maxK, iFileName, oDir, resume)
+
         if not os.path.exists(self.tmpDir):
             os.makedirs(self.tmpDir)
 
         if not os.path.exists(oDir):
             os.makedirs(oDir)
 
-        oFileName = self.assignRandomClasses(2, iFileName)
-        bestRatio = None
-        bestK = None
+        sourceFileName = iFileName
+        checkpoint = self.loadCheckpoint(oDir, mode, sourceFileName) if resume else None
+        if checkpoint is not None:
+            firstK = checkpoint['k']
+            bestK, bestRatio = checkpoint['bestK'], checkpoint['bestRatio']
+            # oDir holds the grouping of the last completed k
+            isConverged, oFileName = self.reassignVectors(oDir + '/k' + str(firstK - 1), checkpoint['means'])
+        else:
+            firstK = 2
+            oFileName = self.assignRandomClasses(2, iFileName)
+            bestRatio = None
+            bestK = None
         means = None # means of the k groups
-        for k in range(2, maxK + 1):
+        for k in range(firstK, maxK + 1):
             iFileName = oFileName
             means, oFileName, inter, intra, minVals, maxVals, sig = self.group(k, iFileName)
             
             # copy the split file into oDir
             shutil.copy(oFileName, oDir + '/k' + str(k))
+            self.saveModel(oDir + '/k' + str(k) + '.model', self.lastStats)
     
             ratio = float(intra)/inter
             if bestRatio == None or ratio < bestRatio:
@@ -285,13 +915,7 @@ class UnsupervisedKMeans:
             # splitting for the next k
     
             # choosing class with largest average attribute variance
-            maxSig = None
-            splitCls = None
-            for cls in range(k):
-                avgSig = np.average(sig[cls])
-                if maxSig == None or avgSig > maxSig:
-                    maxSig = avgSig
-                    splitCls = cls 
+            splitCls = self.chooseSplitClass(k, sig)
     
             baseMean = means[splitCls]
     
@@ -300,11 +924,28 @@ class UnsupervisedKMeans:
             means.append(minusMean)
             means.append(plusMean)
             isConverged, oFileName = self.reassignVectors(oFileName, means)
+            self.saveCheckpoint(oDir, mode, sourceFileName, k + 1, means, bestK, bestRatio)
 
         shutil.rmtree(self.tmpDir)
+        self.removeCheckpoint(oDir)
     
         return bestK, bestRatio
 
+def runRestart(uKMeans, maxK, seed, iFileName, oDir, matrix=None):
+    ''' Pool worker: one seeded sweep over the shared matrix, or over the
+        memory-mapped matrix file if matrix = (fileName, shape) is given '''
+    if not os.path.exists(oDir):
+        os.makedirs(oDir)
+    if matrix is None:
+        X = shared.get_array('X')
+    else:
+        fileName, shape = matrix
+        X = np.memmap(fileName, dtype=np.float64, mode='r', shape=shape)
+    rng = np.random.RandomState(seed)
+    labels = uKMeans.initialClasses(X, rng).astype(np.int32)
+    bestK, bestRatio, scores = uKMeans.sweepMatrix(maxK, X, labels, iFileName, oDir)
+    return scores, uKMeans.computedDistances, uKMeans.skippedDistances
+
 if __name__ == "__main__":
     parser = OptionParser()
     parser.add_option("-f", "--file", dest="filename",
@@ -312,6 +953,27 @@ if __name__ == "__main__":
     parser.add_option("-d", "--dir", dest="dir", help="Existing directory to store groupings with all k")
     parser.add_option("-m", "--kMax", dest="kMax", help="Maximum k value (k - number of groups)")
     parser.add_option("-t", "--tmpDir", dest="tmpDir", help="Temporary directory (default is kmeans_tmp)")
+    parser.add_option("--mode", dest="mode", default="csv", choices=["csv", "memory", "memmap", "minibatch"],
+                              help="Grouping engine: csv (default), memory, memmap or minibatch")
+    parser.add_option("--bounds", dest="bounds", action="store_true", default=False,
+                              help="Skip distance computations using Hamerly's bounds (memory and memmap modes)")
+    parser.add_option("--init", dest="init", default="random", choices=["random", "k-means++"],
+                              help="Seeding of the first grouping: random (default) or k-means++")
+    parser.add_option("--nInit", dest="nInit", type="int", default=1,
+                              help="Number of seeded sweeps run in parallel (memory and memmap modes)")
+    parser.add_option("-p", "--processes", dest="processes", type="int",
+                              help="Number of worker processes (default is number of CPUs)")
+    parser.add_option("-s", "--seed", dest="seed", type="int", help="Random seed")
+    parser.add_option("--localSplit", dest="localSplit", action="store_true", default=False,
+                              help="Re-cluster only around the split group (memory and memmap modes)")
+    parser.add_option("-u", "--update", dest="update", type="int",
+                              help="Append vectors of the input file to the existing grouping into this k")
+    parser.add_option("--passes", dest="passes", type="int", default=0,
+                              help="Refinement passes over the appended vectors (update only)")
+    parser.add_option("-r", "--resume", dest="resume", action="store_true", default=False,
+                              help="Continue the sweep from the checkpoint in the output directory (not with --nInit > 1)")
+    parser.add_option("-b", "--batchSize", dest="batchSize", type="int",
+                              help="Rows in one mini-batch (minibatch mode only)")
 
     (options, args) = parser.parse_args()
 
@@ -319,14 +981,32 @@ if __name__ == "__main__":
     #writeData(X, 'kmeans/gaussData.csv')
     #drawData(X)
 
-    kMax = int(options.kMax) # e. g. 10
+    kMax = int(options.kMax or 0) # e. g. 10
     iFileName = options.filename # e. g. 'test/data/gauss_5_groups.csv'
     oDir = options.dir # e. g. 'test/kmeans/res'
     tmpDir = options.tmpDir # e. g. tmp
 
-    uKMeans = UnsupervisedKMeans()
-    bestK, bestRatio = uKMeans.run(kMax, iFileName, oDir)
-    print 'bestK:', bestK, 'bestRatio: ', bestRatio
+    if tmpDir:
+        uKMeans = UnsupervisedKMeans(tmpDir)
+    else:
+        uKMeans = UnsupervisedKMeans()
+    if options.batchSize:
+        uKMeans.batchSize = options.batchSize
+    uKMeans.useBounds = options.bounds
+    uKMeans.localSplit = options.localSplit
+    uKMeans.init = options.init
+    uKMeans.nInit = options.nInit
+    uKMeans.nWorkers = options.processes
+    uKMeans.seed = options.seed
+
+    if options.update:
+        means = uKMeans.partialFit(options.update, iFileName, oDir, options.passes)
+        print 'means:', means
+    else:
+        bestK, bestRatio = uKMeans.run(kMax, iFileName, oDir, options.mode, options.resume)
+        print 'bestK:', bestK, 'bestRatio: ', bestRatio
+        if options.bounds:
+            print 'distances computed:', uKMeans.computedDistances, 'skipped:', uKMeans.skippedDistances
 
     #for k in range(2, kMax + 1):
     #    X = readClasses(oDir + 'k' + str(k))
@@ -1,130 +1,261 @@
 import csv
 from datetime import datetime
+from itertools import compress, islice, izip
 from os.path import split, splitext, join, exists
 from os import makedirs
 from random import random
 from math import sqrt, fabs
-
-
-def z_factor(source, output, attr=-1, filter=None, update_value=True):
-    # First scan to get mean and deviation
-    attr_sum = 0.0
-    attr_sq_sum = 0.0
-    total_rows = 0
+import numpy as np
+
+from algorithms.arff_data import read_header, data_rows, attribute_name, sparse_row, sparse_value
+from algorithms.grouped import Moments, QuantileSketch
+
+
+def _chunks(reader, chunk_size):
+    '''Yields lists of at most ``chunk_size`` rows of ``reader``.'''
+    while True:
+        rows = list(islice(reader, chunk_size))
+        if not rows:
+            return
+        yield rows
+
+
+def _column(rows, attr):
+    '''Values of the ``attr`` column of ``rows`` as a float array.'''
+    return np.array([row[attr] for row in rows], dtype=float)
+
+
+def _attributes(attr, attr_count):
+    '''Indices of the columns selected by ``attr``: a column, a list of
+    columns or 'numeric' for all of them, of which numeric ones are kept
+    later.'''
+    if attr == 'numeric':
+        return range(attr_count)
+    if isinstance(attr, (list, tuple)):
+        return [a % attr_count for a in attr]
+    return [attr % attr_count]
+
+
+def _matrix(rows, columns, numeric=None):
+    '''Float matrix of the ``columns`` of ``rows``. If ``numeric`` flags are
+    given, a column with a value which is not a number is flagged False and
+    left zero instead of raising ValueError. Columns are contiguous, so
+    each one is reduced the same way whichever columns are selected.'''
+    X = np.zeros((len(rows), len(columns)), order='F')
+    for j, i in enumerate(columns):
+        if numeric is None:
+            X[:, j] = _column(rows, i)
+        elif numeric[j]:
+            try:
+                X[:, j] = _column(rows, i)
+            except ValueError:
+                numeric[j] = False
+    return X
+
+
+def _combine(masks, combine='any'):
+    '''Combines a row of per-attribute masks with any or all.'''
+    if combine == 'all':
+        return masks.all(axis=1)
+    return masks.any(axis=1)
+
+
+def z_factor(source, output, attr=-1, filter=None, update_value=True, chunk_size=10000, combine='any'):
+    '''Normalises (or filters by) attributes with Z factor. ``attr`` is a
+    column, a list of columns or 'numeric' for every numeric column that is
+    not constant. A filter keeps a row if ``combine`` ('any' or 'all') of
+    its attributes pass. Statistics of all attributes are computed in the
+    first scan, they are transformed in the second one. The source is read
+    ``chunk_size`` rows at a time, attribute columns of a chunk are parsed
+    into a matrix once and chunks are written at once.'''
+    # First scan to get means and deviations
+    columns = numeric = None
+    moments = Moments(0)
     with open(source) as source_file:
-        for attr_list in csv.reader(source_file):
-            attr_sum += float(attr_list[attr])
-            attr_sq_sum += float(attr_list[attr]) * float(attr_list[attr])
-            total_rows += 1
-
-    mean = attr_sum / total_rows
-    deviation = sqrt(attr_sq_sum / total_rows  - mean**2)
-
-    # Second file scan to normalise (or filter by) the attribute
+        for rows in _chunks(csv.reader(source_file), chunk_size):
+            if columns is None:
+                columns = _attributes(attr, len(rows[0]))
+                numeric = [True] * len(columns) if attr == 'numeric' else None
+                moments = Moments(len(columns))
+            moments.update(_matrix(rows, columns, numeric))
+
+    means = moments.mean
+    deviations = np.sqrt(moments.variances()) if moments.count else moments.m2
+    if numeric is not None:
+        kept = [j for j in range(len(columns)) if numeric[j] and deviations[j] > 0]
+        columns, means, deviations = [columns[j] for j in kept], means[kept], deviations[kept]
+    elif update_value and not deviations.all():
+        raise ZeroDivisionError('Attribute deviation is zero')
+
+    # Second file scan to normalise (or filter by) the attributes
     output_file = open(output, 'w')
     output_writer = csv.writer(output_file)
     with open(source) as source_file:
-        for attr_list in csv.reader(source_file):
+        for rows in _chunks(csv.reader(source_file), chunk_size):
+            values = _matrix(rows, columns)
             if update_value:
-                attr_list[attr] = (float(attr_list[attr]) - mean) / deviation
-            if (filter is None) or\
-               (filter == 'outliers' and fabs(float(attr_list[attr])) > 3) or\
-               (filter != 'outliers' and fabs(float(attr_list[attr])) < 3):
-                output_writer.writerow(attr_list)
+                values = (values - means) / deviations
+                for j, i in enumerate(columns):
+                    for attr_list, value in izip(rows, values[:, j].tolist()):
+                        attr_list[i] = value
+            if filter is None:
+                output_writer.writerows(rows)
+            elif filter == 'outliers':
+                output_writer.writerows(compress(rows, _combine(np.fabs(values) > 3, combine)))
+            else:
+                output_writer.writerows(compress(rows, _combine(np.fabs(values) < 3, combine)))
     output_file.close()
 
 
-def quartil(source, output, attr=-1, filter=None, update_value=True):
+def quartil(source, output, attr=-1, filter=None, update_value=True, chunk_size=10000, combine='any',
+            error=0.001):
+    '''Writes rows with outlying attributes, ``attr`` and ``combine`` as in
+    ``z_factor``: 'numeric' skips columns whose quartils are equal.
+    Quartils of all attributes are found in the first scan from a
+    ``QuantileSketch`` of each: exact while an attribute has no more than
+    100000 distinct values, then off by about ``error`` in rank from a
+    sketch of constant size (always exact if ``error`` is None).'''
     # First scan to get first and second quartils
-    total = 0
-    each_value_count = {}
+    columns = numeric = None
+    sketches = []
     with open(source) as file:
-        for value_list in csv.reader(file):
-            total += 1
-            value = value_list[attr].strip()
-            if each_value_count.has_key(value):
-                each_value_count[value] += 1
-            else:
-                each_value_count[value] = 1
-
-    Q1, Q2, viewed = None, None, 0
-    for key, count in sorted(each_value_count.items(), key=lambda x: float(x[0])):
-        viewed += count
-        if Q1 is None and viewed > 0.25 * (total + 1):
-            Q1 = float(key)
-        if Q2 is None and viewed > 0.75 * (total + 1):
-            Q2 = float(key)
-
+        for rows in _chunks(csv.reader(file), chunk_size):
+            if columns is None:
+                columns = _attributes(attr, len(rows[0]))
+                numeric = [True] * len(columns) if attr == 'numeric' else None
+                sketches = [QuantileSketch(error) for i in columns]
+            values = _matrix(rows, columns, numeric)
+            for j, sketch in enumerate(sketches):
+                sketch.update(values[:, j])
+
+    Q1s, Q2s, kept = [], [], []
+    for j, sketch in enumerate(sketches):
+        if numeric is None or numeric[j]:
+            Q1 = sketch.value_above(0.25 * (sketch.count + 1))
+            Q2 = sketch.value_above(0.75 * (sketch.count + 1))
+            if numeric is not None and not Q2 > Q1: # every row would be outlying
+                continue
+            Q1s.append(Q1)
+            Q2s.append(Q2)
+            kept.append(columns[j])
+
+    Q1, Q2 = np.array(Q1s, dtype=float), np.array(Q2s, dtype=float)
     IQR = Q2 - Q1
 
-    # Second file scan to normalise (or filter by) the attribute
+    # Second file scan to normalise (or filter by) the attributes
     output_file = open(output, 'w')
     output_writer = csv.writer(output_file)
     with open(source) as source_file:
-        for attr_list in csv.reader(source_file):
-            is_outlier = bool(float(attr_list[attr]) <= Q1 - 1.5*IQR or\
-                              float(attr_list[attr]) >= Q2 + 1.5*IQR)
-            if (filter == 'outliers' and is_outlier) or\
-               (filter != 'outliers' and is_outlier):
-                output_writer.writerow(attr_list)
+        for rows in _chunks(csv.reader(source_file), chunk_size):
+            values = _matrix(rows, kept)
+            is_outlier = (values <= Q1 - 1.5*IQR) | (values >= Q2 + 1.5*IQR)
+            output_writer.writerows(compress(rows, _combine(is_outlier, combine)))
     output_file.close()
 
 
-def filter(source, output, attr=-1, filter=None, method='z-factor', update_value=False):
-    '''Applies one for the filters to the attribute:
+def filter(source, output, attr=-1, filter=None, method='z-factor', update_value=False, combine='any',
+           error=0.001):
+    '''Applies one for the filters to the attributes (a column, a list of
+    columns or 'numeric'), a row passes if ``combine`` ('any' or 'all') of
+    them pass:
             Z-factor - normalised value is not in [-3, 3]
             Quartil - value is <= Q1 - 1.5 * (Q2 - Q1)
-                            or >= Q2 + 1.5 * (Q2 - Q1)
+                            or >= Q2 + 1.5 * (Q2 - Q1),
+                      quartils of attributes with many distinct values
+                      are off by ``error`` in rank, exact if it is None
             '''
     if method == 'z-factor':
-        z_factor(source, output, attr, filter, update_value)
+        z_factor(source, output, attr, filter, update_value, combine=combine)
     elif method == 'quartil':
-        quartil(source, output, attr, filter, update_value)
+        quartil(source, output, attr, filter, update_value, combine=combine, error=error)
 
 
-def normalise(source, output, attr=-1, filter=None):
-    '''Applies Z normalisation for the attribute: substracts mean and divides
-    by deviation.'''
-    z_factor(source, output, attr, filter, update_value=True)
+def normalise(source, output, attr=-1, filter=None, combine='any'):
+    '''Applies Z normalisation for the attributes (a column, a list of
+    columns or 'numeric'): substracts mean and divides by deviation.'''
+    z_factor(source, output, attr, filter, update_value=True, combine=combine)
 
 
-def transpose(source, output, attr=-1, arff=False, *args, **kwargs):
+def transpose(source, output, attr=-1, arff=False, sparse=False, *args, **kwargs):
     '''Categorical attribute is changed to attribute list: an attribute for
     each category is created, which value is 1 if the vector belongs to this
-    category and 0 if it does not.'''
+    category and 0 if it does not. With ``sparse`` an ARFF file is written
+    whose rows are {index value} pairs without the zero category attributes.
+    Sparse ARFF sources are read as well.'''
 
+    header = None
     values = set()
+    numeric = None
     with open(source) as source_file:
         if arff:
-            for row in source_file:
-                if row.strip().lower().startswith("@data"):
-                    break
-        for attr_list in csv.reader(source_file):
+            header = read_header(source_file)
+        for attr_list in data_rows(source_file, header):
             value = attr_list[attr].strip()
             values.add(value)
+            if sparse and not arff:
+                numeric = _numeric_columns(attr_list, numeric)
 
     values = sorted(list(values))
+    index = dict((value, i) for i, value in enumerate(values))
 
     output_file = open(output, 'w')
     output_writer = csv.writer(output_file)
     with open(source) as source_file:
         if arff:
-            for row in source_file:
-                output_file.write(row)
-                if row.strip().lower().startswith("@data"):
-                    break
-        for attr_list in csv.reader(source_file):
-            value = attr_list[attr]
-            transposed = []
-            for v in values:
-                if v.strip() == value.strip():
-                    transposed.append(' 1')
-                else:
-                    transposed.append(' 0')
-            output_writer.writerow(attr_list[:attr] + transposed + attr_list[attr:][1:])
+            header = read_header(source_file)
+        if sparse:
+            output_file.writelines(_transposed_header(source, header, numeric, attr, values))
+        elif arff:
+            output_file.writelines(header)
+        zeros = [' 0'] * len(values)
+        for attr_list in data_rows(source_file, header):
+            category = index[attr_list[attr].strip()]
+            if sparse:
+                column = attr % len(attr_list)
+                row = dict(enumerate(attr_list[:column]))
+                row[column + category] = '1'
+                row.update((column + len(values) + i, value) for i, value in enumerate(attr_list[column + 1:]))
+                output_file.write(sparse_row(row))
+            else:
+                transposed = list(zeros)
+                transposed[category] = ' 1'
+                output_writer.writerow(attr_list[:attr] + transposed + attr_list[attr:][1:])
     output_file.close()
 
 
+def _numeric_columns(attr_list, numeric=None):
+    '''Flags of columns which are numbers in ``attr_list`` and were so in
+    the rows ``numeric`` flags came from.'''
+    if numeric is None:
+        numeric = [True] * len(attr_list)
+    for i, value in enumerate(attr_list):
+        if numeric[i]:
+            try:
+                float(value)
+            except ValueError:
+                numeric[i] = False
+    return numeric
+
+
+def _transposed_header(source, header, numeric, attr, values):
+    '''ARFF header of ``transpose`` output, the ``attr`` attribute replaced
+    by a numeric attribute for each category. A CSV source gets attributes
+    attr0, attr1, ... of ``numeric`` flags.'''
+    if header is None:
+        relation = splitext(split(source)[1])[0]
+        if isinstance(relation, unicode):
+            relation = relation.encode('utf-8')
+        header = ['@relation %s\n' % sparse_value(relation)]
+        for i, is_numeric in enumerate(numeric or []):
+            header.append('@attribute attr%d %s\n' % (i, 'numeric' if is_numeric else 'string'))
+        header.append('@data\n')
+    positions = [i for i, line in enumerate(header) if line.strip().lower().startswith('@attribute')]
+    position = positions[attr]
+    name = attribute_name(header[position])
+    categories = ['@attribute %s numeric\n' % sparse_value('%s=%s' % (name, value)) for value in values]
+    return header[:position] + categories + header[position + 1:]
+
+
 def _value_by_prob(each_value_count, total):
     missing = each_value_count.get('?', 0)
 
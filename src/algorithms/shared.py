@@ -0,0 +1,39 @@
+from multiprocessing import Pool
+from multiprocessing.sharedctypes import RawArray
+import numpy as np
+
+# Arrays attached in a worker process, by name.
+arrays = {}
+
+
+def share_array(X):
+    '''Copies matrix ``X`` into shared memory. The result can be given to
+    ``pool`` and read by every worker without being pickled.'''
+    X = np.ascontiguousarray(X)
+    buf = RawArray('c', max(X.nbytes, 1))
+    shared = np.frombuffer(buf, dtype=X.dtype, count=X.size).reshape(X.shape)
+    shared[...] = X
+    return buf, X.dtype.str, X.shape
+
+
+def attach_arrays(shared):
+    '''Pool initializer: makes shared arrays available through ``get_array``.'''
+    for name, (buf, dtype, shape) in shared.items():
+        dtype = np.dtype(dtype)
+        X = np.frombuffer(buf, dtype=dtype, count=int(np.prod(shape))).reshape(shape)
+        X.flags.writeable = False
+        arrays[name] = X
+
+
+def get_array(name):
+    return arrays[name]
+
+
+def pool(processes=None, maxtasksperchild=None, **named_arrays):
+    '''Returns a process pool whose workers can read the given matrices with
+    ``get_array(name)``. The matrices are copied into shared memory once,
+    workers get them on start-up through inheritance, so workers replaced
+    after ``maxtasksperchild`` tasks get them as well.'''
+    shared = dict((name, share_array(X)) for name, X in named_arrays.items())
+    attach_arrays(shared)
+    return Pool(processes, initializer=attach_arrays, initargs=(shared,), maxtasksperchild=maxtasksperchild)
@@ -1,31 +1,38 @@
-import csv
+from itertools import islice
 from arff import dump as dump_arff
 from math import sqrt
+import numpy as np
 from django.utils.translation import ugettext as _
 
+from algorithms.arff_data import read_header, data_rows
+from algorithms.grouped import GroupStatistics, QuantileSketch
 
-def statistics(source, output, arff=False, *args, **kwargs):
-    '''Return min, max, mean, std, median for each column.'''
+
+def statistics(source, output, arff=False, error=0.001, chunk_size=10000, *args, **kwargs):
+    '''Return min, max, mean, std, median for each column. Medians come from
+    a ``QuantileSketch`` of each column: exact while a column has no more
+    than 100000 distinct values, then of constant size and off by about
+    ``error`` in rank (always exact if ``error`` is None). Values are added
+    to it ``chunk_size`` at a time.'''
     mins = []
     maxs = []
     attr_sums = []
     attr_sq_sums = []
-    each_value_counts = []
+    sketches = []
+    pending = []
     stats = []
     total_rows = 0.0
     with open(source) as source_file:
-        if arff:
-            for row in source_file:
-                if row.strip().lower().startswith("@data"):
-                    break
+        header = read_header(source_file) if arff else None
         attr_count = None
-        for attr_list in csv.reader(source_file):
+        for attr_list in data_rows(source_file, header):
             if not attr_sums:
                 attr_count = len(attr_list)
                 for i in range(attr_count):
                     attr_sums.append(0.0)
                     attr_sq_sums.append(0.0)
-                    each_value_counts.append({})
+                    sketches.append(QuantileSketch(error))
+                    pending.append([])
                     stats.append({})
                     mins.append(None)
                     maxs.append(None)
@@ -48,11 +55,10 @@ def statistics(source, output, arff=False, *args, **kwargs):
                 if not maxs[i] or attr_float > maxs[i]:
                     maxs[i] = attr_float
 
-                value = float(attr.strip())
-                if each_value_counts[i].has_key(value):
-                    each_value_counts[i][value] += 1
-                else:
-                    each_value_counts[i][value] = 1
+                pending[i].append(attr_float)
+                if len(pending[i]) == chunk_size:
+                    sketches[i].update(pending[i])
+                    pending[i] = []
 
         for i in range(attr_count):
             if not stats[i].has_key('min'):
@@ -66,12 +72,8 @@ def statistics(source, output, arff=False, *args, **kwargs):
                 std = sqrt(attr_sq_sums[i] / total_rows - stats[i]['mean']**2)
                 stats[i]['std'] = round(std, 8)
             if not stats[i].has_key('median'):
-                stats[i]['median'] = None
-                viewed = 0
-                for key, count in sorted(each_value_counts[i].items(), key=lambda x: x[0]):
-                    viewed += count
-                    if stats[i]['median'] is None and viewed > 0.5 * (total_rows + 1):
-                        stats[i]['median'] = round(key, 8)
+                median = sketches[i].update(pending[i]).value_above(0.5 * (total_rows + 1))
+                stats[i]['median'] = None if median is None else round(median, 8)
 
     content = []
     for i in range(attr_count):
@@ -80,3 +82,52 @@ def statistics(source, output, arff=False, *args, **kwargs):
         content.append(line)
     dump_arff(output, content, relation=_("Statistical primitives"),
                            names=["min", "max", "mean", "std", "median"])
+
+
+def grouped_statistics(source, output, attr=-1, arff=False, chunk_size=10000,
+                       *args, **kwargs):
+    '''Return min, max, mean, std of each column for every value of the
+    ``attr`` column.'''
+    classes = {}
+    stats = None
+    with open(source) as source_file:
+        header = read_header(source_file) if arff else None
+        reader = data_rows(source_file, header)
+        while True:
+            rows = list(islice(reader, chunk_size))
+            if not rows:
+                break
+            rows = [row for row in rows if row and not row[0].startswith('%')]
+            if not rows:
+                continue
+            if stats is None:
+                attr_count = len(rows[0])
+                attr = attr % attr_count
+                columns = [i for i in range(attr_count) if i != attr]
+                numeric = [True] * len(columns)
+                stats = GroupStatistics(0, len(columns))
+
+            labels = [classes.setdefault(row[attr].strip(), len(classes)) for row in rows]
+            X = np.zeros((len(rows), len(columns)))
+            for j, i in enumerate(columns):
+                if numeric[j]:
+                    try:
+                        X[:, j] = [float(row[i]) for row in rows]
+                    except ValueError:
+                        numeric[j] = False
+            stats.grow(len(classes)).update(X, labels)
+
+    content = []
+    if stats is not None:
+        means = stats.means()
+        stds = np.sqrt(np.maximum(stats.variances() - means ** 2, 0))
+        for value, cls in sorted(classes.items()):
+            for j, i in enumerate(columns):
+                if numeric[j]:
+                    content.append([value, i, round(stats.mins[cls, j], 8),
+                                    round(stats.maxs[cls, j], 8),
+                                    round(means[cls, j], 8), round(stds[cls, j], 8)])
+                else:
+                    content.append([value, i, '-', '-', '-', '-'])
+    dump_arff(output, content, relation=_("Grouped statistical primitives"),
+              names=["class", "attr", "min", "max", "mean", "std"])
@@ -3,3 +3,5 @@ TEST_FILE_PATH = 'src/algorithms/tests/data'
 from algorithms.tests.kmeans import *
 from algorithms.tests.c45 import *
 from algorithms.tests.preprocess import *
+from algorithms.tests.grouped import *
+from algorithms.tests.crossval import *
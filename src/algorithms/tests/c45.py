@@ -1,8 +1,26 @@
 from unittest import TestCase
 from algorithms.c45 import c45
 from algorithms.c45 import tools
+from algorithms.c45 import flat
+from algorithms.c45 import sm_utils
+from algorithms.c45 import hoeffding
+from algorithms.c45 import ensemble
+from pickle import dump
 from algorithms.tests import TEST_FILE_PATH
 from os.path import join
+import os
+import sys
+import random
+from StringIO import StringIO
+
+def dumpTree(tree, indent=''):
+    ''' Lines of tests and leaves of tree, in the format of vertebral_trees.txt '''
+    if tree.nodeType == 'leaf':
+        return ['%sleaf %r %r' % (indent, tree.leaf, sorted(tree.classDist.items()))]
+    lines = ['%satt %d <= %r' % (indent, tree.test.testedAtt, tree.test.cut)]
+    for branch in tree.branches:
+        lines += dumpTree(branch, indent + '  ')
+    return lines
 
 class C45Tests(TestCase):
     def test_tree(self):
@@ -15,3 +33,283 @@ class C45Tests(TestCase):
         
         cls = tree.getClass(learnData[0])
         self.assertEquals(2, cls)
+
+    def test_trees_of_row_search(self):
+        # vertebral_trees.txt holds the trees built by the search over sorted
+        # rows that preceded the presorted one, with costs and with ties
+        learnData = tools.readData(join(TEST_FILE_PATH, "vertebral_learn.data"))
+        cases = [('exact', learnData, {}),
+                 ('costs', learnData, {'costs': [[0, 1, 4], [2, 0, 1], [1, 3, 0]], 'priorCorrection': True}),
+                 ('ties', [[round(v) for v in row[:-1]] + row[-1:] for row in learnData], {})]
+        dumps = []
+        for name, data, options in cases:
+            alg = c45.C45(data, **options)
+            tree = alg.constructTree()
+            dumps += ['# ' + name] + dumpTree(tree)
+            dumps += ['# %s pruned' % name] + dumpTree(alg.pruneTree(tree, 0.75))
+        expected = open(join(TEST_FILE_PATH, "vertebral_trees.txt")).read().splitlines()
+        self.assertEquals(expected, dumps)
+
+    def test_matrix(self):
+        learnFile = join(TEST_FILE_PATH, "vertebral_learn.data")
+
+        learnData = tools.readData(learnFile)
+        X, y = tools.readMatrix(learnFile)
+        self.assertEquals((len(learnData), len(learnData[0]) - 1), X.shape)
+
+        rowsTree = c45.C45(learnData).constructTree()
+        matrixTree = c45.C45(X, y=y).constructTree()
+        for vector in X:
+            self.assertEquals(rowsTree.getClass(vector), matrixTree.getClass(vector))
+        self.assertEquals(rowsTree.countLeaves(), matrixTree.countLeaves())
+
+    def test_binned(self):
+        X, y = tools.readMatrix(join(TEST_FILE_PATH, "vertebral_learn.data"))
+
+        # a bin for every distinct value gives the exact tree
+        exactTree = c45.C45(X, y=y).constructTree()
+        binnedTree = c45.C45(X, y=y, bins=256).constructTree()
+        self.assertEquals(exactTree.countLeaves(), binnedTree.countLeaves())
+        self.assertEquals(0, c45.countErrors(binnedTree, X, [exactTree.getClass(v) for v in X]))
+
+        alg = c45.C45(X, y=y, bins=8)
+        self.assertTrue(all(len(cuts) < 8 for cuts in alg.binCuts))
+        tree = alg.constructTree()
+        self.assertTrue(tree.test.cut in alg.binCuts[tree.test.testedAtt])
+        self.assertTrue(c45.countErrors(tree, X, y) < 0.1 * len(y))
+
+        # codes are uint8, at least one cut is needed
+        for bins in [1, -4, 257]:
+            self.assertRaises(ValueError, c45.C45, X, y=y, bins=bins)
+            self.assertRaises(ValueError, c45.quantileBins, X, bins)
+
+    def test_parallel(self):
+        X, y = tools.readMatrix(join(TEST_FILE_PATH, "vertebral_learn.data"))
+
+        for bins in [None, 16]:
+            tree = c45.C45(X, y=y, bins=bins).constructTree()
+            alg = c45.C45(X, y=y, bins=bins, nWorkers=2)
+            alg.subtreeSize = 50 # split the root here, subtrees in workers
+            parallelTree = alg.constructTree()
+            self.assertEquals(tree.countLeaves(), parallelTree.countLeaves())
+            self.assertEquals(tree.test.cut, parallelTree.test.cut)
+            self.assertEquals(0, c45.countErrors(parallelTree, X, [tree.getClass(v) for v in X]))
+
+    def test_flat(self):
+        X, y = tools.readMatrix(join(TEST_FILE_PATH, "vertebral_learn.data"))
+        testX, testY = tools.readMatrix(join(TEST_FILE_PATH, "vertebral_test.data"))
+        alg = c45.C45(X, y=y)
+        tree = alg.pruneTree(alg.constructTree())
+
+        flatTree = flat.compileTree(tree)
+        self.assertEquals(tree.countLeaves(), flatTree.countLeaves())
+        self.assertEquals(sorted(tree.classDist.values()), sorted(flatTree.classDist[0][flatTree.classDist[0] > 0]))
+        flatTree.blockSize = 7
+        self.assertEquals([tree.getClass(v) for v in testX], flatTree.predictBatch(testX).tolist())
+        self.assertEquals(0, len(flatTree.predictBatch(testX[:0])))
+
+    def test_classify_file(self):
+        learnFile = join(TEST_FILE_PATH, "vertebral_learn.data")
+        testFile = join(TEST_FILE_PATH, "vertebral_test.data")
+        output = join(TEST_FILE_PATH, 'tmp', 'vertebral_classified.data')
+        X, y = tools.readMatrix(learnFile)
+        alg = c45.C45(X, y=y)
+        tree = alg.pruneTree(alg.constructTree())
+
+        errors, total, confusion = c45.classifyFile(tree, testFile, output, chunkSize=16)
+        classified, expectedErrors = c45.classifyData(tree, tools.readData(testFile))
+        self.assertEquals(expectedErrors, errors)
+        self.assertEquals(len(classified), total)
+        self.assertEquals(total, sum(confusion.values()))
+        self.assertEquals(errors, sum(n for (a, p), n in confusion.items() if a != p))
+        self.assertEquals([row[-1] for row in classified], [row[-1] for row in tools.readData(output)])
+
+    def test_model_file(self):
+        X, y = tools.readMatrix(join(TEST_FILE_PATH, "vertebral_learn.data"))
+        modelFile = join(TEST_FILE_PATH, 'tmp', 'vertebral.tree')
+        alg = c45.C45(X, y=y)
+        tree = alg.pruneTree(alg.constructTree())
+        expected = [tree.getClass(v) for v in X]
+
+        sm_utils.saveTree(modelFile, tree, {'learnFile': 'vertebral_learn.data'})
+        for mmap in [True, False]:
+            loaded = sm_utils.loadTree(modelFile, mmap)
+            self.assertEquals({'learnFile': 'vertebral_learn.data'}, loaded.metadata)
+            self.assertEquals(expected, loaded.predictBatch(X).tolist())
+            self.assertEquals(expected, [loaded.getClass(v) for v in X])
+            self.assertTrue((flat.compileTree(tree).classDist == loaded.classDist).all())
+
+        # legacy pickled trees
+        dump(tree, open(modelFile, 'wb'))
+        self.assertEquals(expected, [sm_utils.loadTree(modelFile).getClass(v) for v in X])
+
+    def test_draw_tree(self):
+        data = [row[:2] + row[-1:] for row in tools.readData(join(TEST_FILE_PATH, "vertebral_learn.data"))]
+        alg = c45.C45(data)
+        tree = alg.pruneTree(alg.constructTree())
+
+        bounds = (20.0, 130.0, -10.0, 50.0)
+        image = sm_utils.decisionSurface(tree, bounds, 50)
+        self.assertEquals((50, 50, 3), image.shape)
+        # cell (row i, column j) is centred at (x_j, y_i)
+        x = 20.0 + 10.5 * 110.0 / 50
+        y = -10.0 + 30.5 * 60.0 / 50
+        expected = sm_utils.colorConverter.to_rgb(tools.colors[tree.getClass([x, y])][1])
+        self.assertEquals(expected, tuple(image[30, 10]))
+
+        output = join(TEST_FILE_PATH, 'tmp', 'vertebral_tree.png')
+        sm_utils.drawTree(data, tree, save_to=output, resolution=50)
+        self.assertTrue(os.path.exists(output))
+
+        # surfaces of model files are cached, the least recently drawn are dropped
+        modelFile = join(TEST_FILE_PATH, 'tmp', 'vertebral_2d.tree')
+        sm_utils.saveTree(modelFile, tree)
+        sm_utils.surfaceCache.clear()
+        sm_utils.drawTree(data, modelFile, save_to=output, resolution=10)
+        first = sm_utils.surfaceCache.values()[0]
+        for resolution in range(11, 11 + sm_utils.surfaceCacheSize):
+            sm_utils.drawTree(data, modelFile, save_to=output, resolution=resolution)
+            sm_utils.drawTree(data, modelFile, save_to=output, resolution=10)
+        self.assertEquals(sm_utils.surfaceCacheSize, len(sm_utils.surfaceCache))
+        self.assertTrue(sm_utils.surfaceCache.values()[-1] is first)
+        self.assertEquals(range(12, 11 + sm_utils.surfaceCacheSize) + [10],
+                          [key[3] for key in sm_utils.surfaceCache])
+
+    def test_hoeffding(self):
+        random.seed(2013)
+        def stream(n):
+            for i in xrange(n):
+                x, y = random.random(), random.random()
+                yield [x, y, int(x > 0.4)]
+
+        learner = hoeffding.HoeffdingTree().learn(stream(5000))
+        tree = learner.toTree()
+        self.assertEquals(0, tree.test.testedAtt)
+        self.assertAlmostEquals(0.4, tree.test.cut, delta=0.1)
+        self.assertEquals(5000, round(tree.N))
+
+        testData = list(stream(1000))
+        flatTree = flat.compileTree(tree)
+        X = [row[:-1] for row in testData]
+        self.assertEquals([tree.getClass(v) for v in X], flatTree.predictBatch(X).tolist())
+        self.assertTrue(c45.countErrors(tree, X, [row[-1] for row in testData]) < 100)
+
+        stdout, sys.stdout = sys.stdout, StringIO()
+        try:
+            sm_utils.printTree(tree)
+            printed = sys.stdout.getvalue()
+        finally:
+            sys.stdout = stdout
+        self.assertTrue(printed.startswith('0 <= '))
+
+        # one pass over ARFF rows, classes are strings; 150 rows are too few
+        # to clear the bound, so iris is streamed shuffled 40 times
+        rows = list(tools.readRows(join(TEST_FILE_PATH, 'iris.arff'), arff=True))
+        def irisStream(repeats):
+            for i in xrange(repeats):
+                shuffled = rows[:]
+                random.shuffle(shuffled)
+                for row in shuffled:
+                    yield row
+
+        learner = hoeffding.HoeffdingTree(gracePeriod=30, delta=0.01).learn(irisStream(40))
+        self.assertEquals(set(['Iris-setosa', 'Iris-versicolor', 'Iris-virginica']), learner.classes)
+        tree = learner.toTree()
+        self.assertEquals(6000, tree.N)
+        self.assertTrue(tree.countLeaves() >= 3)
+        self.assertTrue(tree.test.testedAtt in (2, 3)) # petal length or width
+        X = [row[:-1] for row in rows]
+        self.assertTrue(c45.countErrors(tree, X, [row[-1] for row in rows]) < 0.1 * len(rows))
+
+        # nominal attributes are refused before any row is learnt
+        arffFile = join(TEST_FILE_PATH, 'tmp', 'hoeffding_nominal.arff')
+        if not os.path.exists(os.path.dirname(arffFile)):
+            os.makedirs(os.path.dirname(arffFile))
+        with open(arffFile, 'w') as f:
+            f.write('@relation colors\n@attribute x real\n@attribute color {red, green}\n'
+                    '@attribute class {a, b}\n@data\n0.5,red,a\n0.1,green,b\n')
+        learner = hoeffding.HoeffdingTree()
+        try:
+            learner.learn(tools.readRows(arffFile, arff=True))
+            self.fail('nominal attribute read as a number')
+        except ValueError as e:
+            self.assertTrue('nominal attributes (1)' in str(e))
+        self.assertEquals(set(), learner.classes)
+
+    def test_ensemble(self):
+        X, y = tools.readMatrix(join(TEST_FILE_PATH, "vertebral_learn.data"))
+        testX, testY = tools.readMatrix(join(TEST_FILE_PATH, "vertebral_test.data"))
+
+        bagged = ensemble.BaggedTrees(10, subspace=4, seed=2013).learn(X, y)
+        self.assertEquals(10, len(bagged.trees))
+        self.assertEquals([0, 1, 2], bagged.classes)
+        self.assertTrue(0 < bagged.oobError < 0.3)
+        predicted = bagged.predictBatch(testX)
+        self.assertTrue((predicted != testY).mean() < 0.3)
+
+        # a single tree votes alone
+        single = ensemble.BaggedTrees(1, seed=2013).learn(X, y)
+        tree = single.trees[0]
+        self.assertEquals([tree.getClass(v) for v in testX], single.predictBatch(testX).tolist())
+
+        # workers draw the same samples
+        parallel = ensemble.BaggedTrees(10, nWorkers=2, subspace=4, seed=2013).learn(X, y)
+        self.assertEquals(bagged.oobError, parallel.oobError)
+        self.assertEquals(predicted.tolist(), parallel.predictBatch(testX).tolist())
+
+    def test_nominal(self):
+        arffFile = join(TEST_FILE_PATH, 'tmp', 'nominal.arff')
+        if not os.path.exists(os.path.dirname(arffFile)):
+            os.makedirs(os.path.dirname(arffFile))
+        rng = random.Random(2013)
+        colors = ['red', 'green', 'blue', 'black', 'white', 'gray']
+        with open(arffFile, 'w') as f:
+            f.write('@relation colors\n@attribute x real\n@attribute color {%s}\n@attribute class {a, b}\n@data\n' % ', '.join(colors))
+            for i in range(300):
+                color = rng.choice(colors)
+                f.write('%f,%s,%s\n' % (rng.random(), color, 'a' if color in ('green', 'black', 'gray') else 'b'))
+        X, y, nominal = tools.readArff(arffFile)
+        self.assertEquals({1: colors}, nominal)
+
+        # one subset split separates the classes
+        learner = c45.C45(X, y=y, nominal=nominal)
+        tree = learner.constructTree()
+        self.assertEquals(2, tree.countLeaves())
+        self.assertEquals(1, tree.test.testedAtt)
+        self.assertTrue(set(tree.test.subset) in (set([1, 3, 5]), set([0, 2, 4])))
+        self.assertEquals(0, c45.countErrors(tree, X, y))
+        binned = c45.C45(X, y=y, nominal=nominal, bins=4)
+        self.assertEquals(tree.test.subset, binned.constructTree().test.subset)
+
+        # the compiled tree routes categories as the tree does, also when loaded
+        flatTree = flat.compileTree(tree)
+        self.assertEquals([tree.getClass(v) for v in X], flatTree.predictBatch(X).tolist())
+        modelFile = join(TEST_FILE_PATH, 'tmp', 'nominal.tree')
+        sm_utils.saveTree(modelFile, tree)
+        self.assertEquals(y, sm_utils.loadTree(modelFile).predictBatch(X).tolist())
+        self.assertEquals(0, c45.learnAndClassify(arffFile, join(TEST_FILE_PATH, 'tmp', 'nominal_out.arff'), arff=True))
+
+    def test_nominal_missing_values(self):
+        attributes = [None, ['red', 'green', 'blue'], ['a', 'b']]
+        X = tools.encodeRows([['0.5', ' green'], ['1', '?']], attributes[:-1])
+        self.assertEquals([[0.5, 1], [1, tools.MISSING]], X.tolist())
+        try:
+            tools.encodeRows([['0.5', 'pink']], attributes[:-1])
+            self.fail('undeclared value encoded')
+        except ValueError as e:
+            self.assertTrue("'pink'" in str(e) and 'attribute 1' in str(e))
+
+        # missing colors go with the categories outside the subset
+        rng = random.Random(2013)
+        rows, y = [], []
+        for i in range(300):
+            color = rng.choice(attributes[1] + ['?'])
+            rows.append([str(rng.random()), color])
+            y.append('a' if color in ('red', 'blue') else 'b')
+        X = tools.encodeRows(rows, attributes[:-1])
+        nominal = tools.nominalAttributes(attributes)
+        for bins in (None, 4):
+            tree = c45.C45(X, y=y, nominal=nominal, bins=bins).constructTree()
+            self.assertEquals([0, 2], tree.test.subset)
+            self.assertEquals(0, c45.countErrors(tree, X, y))
+            self.assertEquals(y, flat.compileTree(tree).predictBatch(X).tolist())
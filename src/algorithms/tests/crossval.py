@@ -0,0 +1,30 @@
+from unittest import TestCase
+from os.path import join
+import numpy as np
+from algorithms import crossval
+from algorithms.c45 import tools
+from algorithms.tests import TEST_FILE_PATH
+
+
+class CrossValidationTests(TestCase):
+    def test_stratified_folds_partition_rows(self):
+        y = np.array([0] * 30 + [1] * 12 + [2] * 5)
+        folds = crossval.stratified_folds(y, 4, seed=1)
+        rows = np.concatenate(folds)
+        self.assertEqual(sorted(rows.tolist()), range(len(y)))
+        self.assertEqual(sorted(len(fold) for fold in folds), [11, 12, 12, 12])
+        for fold in folds:
+            self.assertTrue(7 <= np.sum(y[fold] == 0) <= 8)
+            self.assertEqual(np.sum(y[fold] == 1), 3)
+
+    def test_parallel_folds_match_serial(self):
+        X, y = tools.readMatrix(join(TEST_FILE_PATH, "vertebral_learn.data"))
+        serial = crossval.cross_validate(X, y, k=5, processes=1, seed=3)
+        parallel = crossval.cross_validate(X, y, k=5, processes=2, seed=3)
+        self.assertEqual([m['error'] for m in serial['folds']], [m['error'] for m in parallel['folds']])
+        self.assertEqual(sum(m['size'] for m in parallel['folds']), len(y))
+        self.assertAlmostEqual(parallel['mean']['error'], np.mean([m['error'] for m in parallel['folds']]))
+        self.assertTrue(all(m['time'] >= 0 and m['memory'] >= 0 for m in parallel['folds']))
+
+        clusters = crossval.cross_validate(X, y, crossval.kmeans_fold, k=5, processes=2, seed=3)
+        self.assertTrue(0 < clusters['mean']['purity'] <= 1)
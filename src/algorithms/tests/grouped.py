@@ -0,0 +1,104 @@
+from unittest import TestCase
+from os.path import join
+import arff
+import numpy as np
+from algorithms.tests import TEST_FILE_PATH
+from algorithms.grouped import GroupStatistics, Moments, QuantileSketch, group_statistics
+from algorithms.statistics import grouped_statistics
+
+
+class GroupStatisticsTests(TestCase):
+    def test_grouped_reduction_matches_loops(self):
+        rng = np.random.RandomState(2013)
+        X = rng.normal(size=(1000, 3))
+        labels = rng.randint(0, 4, 1000)
+        centers = rng.normal(size=(5, 3))
+
+        stats = group_statistics(X, labels, 5, centers, block_size=128)
+
+        for cls in range(4):
+            members = X[labels == cls]
+            self.assertEqual(stats.counts[cls], members.shape[0])
+            self.assertTrue(np.allclose(stats.sums[cls], members.sum(axis=0)))
+            self.assertTrue(np.allclose(stats.sq_sums[cls], ((members - centers[cls]) ** 2).sum(axis=0)))
+            self.assertTrue(np.array_equal(stats.mins[cls], members.min(axis=0)))
+            self.assertTrue(np.array_equal(stats.maxs[cls], members.max(axis=0)))
+        self.assertEqual(stats.counts[4], 0)
+
+    def test_groups_added_while_updating(self):
+        stats = GroupStatistics(0, 1)
+        stats.grow(1).update([[1.0], [3.0]], [0, 0])
+        stats.grow(2).update([[2.0], [5.0]], [1, 0])
+        self.assertEqual(list(stats.counts), [3, 1])
+        self.assertEqual(list(stats.means()[:, 0]), [3.0, 2.0])
+        self.assertEqual(list(stats.maxs[:, 0]), [5.0, 2.0])
+
+    def test_variances_of_small_groups(self):
+        stats = group_statistics(np.array([[1.0], [3.0], [5.0]]), np.array([0, 0, 1]), 3,
+                                 np.array([[2.0], [5.0], [0.0]]))
+        with np.errstate(all='raise'):
+            self.assertEqual(list(stats.variances(ddof=1)[:, 0]), [2.0, 0.0, 0.0])
+            self.assertEqual(list(stats.variances()[:, 0]), [1.0, 0.0, 0.0])
+
+    def test_grouped_statistics_file(self):
+        rng = np.random.RandomState(2013)
+        X = rng.normal(size=(301, 2))
+        classes = np.array(['b', 'a', 'c'])[np.minimum(rng.randint(0, 2, 301), np.arange(301))]
+        classes[-1] = 'c' # a group of one row
+        source = join(TEST_FILE_PATH, 'tmp', 'grouped.csv')
+        output = join(TEST_FILE_PATH, 'tmp', 'grouped_stats.arff')
+        with open(source, 'w') as source_file:
+            for row, cls in zip(X, classes):
+                source_file.write('%r,%s,%r\n' % (row[0], cls, row[1]))
+
+        with np.errstate(all='raise'):
+            grouped_statistics(source, output, attr=1, chunk_size=50)
+        rows = [list(row) for row in arff.load(output)]
+        self.assertEqual([(row[0], row[1]) for row in rows],
+                         [('a', 0), ('a', 2), ('b', 0), ('b', 2), ('c', 0), ('c', 2)])
+        for value, attr, low, high, mean, std in rows:
+            column = X[classes == value, attr // 2]
+            self.assertAlmostEqual(low, column.min(), 8)
+            self.assertAlmostEqual(high, column.max(), 8)
+            self.assertAlmostEqual(mean, column.mean(), 8)
+            self.assertAlmostEqual(std, column.std(), 7)
+
+    def test_moments_merged_by_chunks(self):
+        rng = np.random.RandomState(2013)
+        X = rng.normal(1e6, 0.01, size=(1003, 2))
+        moments = Moments(2)
+        for start in range(0, 1003, 100):
+            moments.update(X[start:start + 100])
+        self.assertEqual(moments.count, 1003)
+        self.assertTrue(np.allclose(moments.mean, X.mean(axis=0), rtol=1e-15))
+        self.assertTrue(np.allclose(moments.variances(), X.var(axis=0), rtol=1e-8))
+        self.assertTrue(np.allclose(moments.variances(ddof=1), X.var(axis=0, ddof=1), rtol=1e-8))
+
+    def test_quantile_sketch(self):
+        rng = np.random.RandomState(2013)
+        x = rng.lognormal(size=100000)
+        values = np.sort(x)
+
+        # exact without error, as counting every value
+        exact = QuantileSketch().update(np.round(x[:1000], 1))
+        rounded = np.sort(np.round(x[:1000], 1))
+        self.assertEqual(exact.value_above(250.25), rounded[250])
+        self.assertEqual(exact.value_above(750.75), rounded[750])
+        self.assertEqual(exact.value_above(1000), None)
+
+        # exact up to exact_size distinct values
+        small = QuantileSketch(0.01, exact_size=1000).update(np.round(x[:1000], 1))
+        self.assertEqual(small.value_above(250.25), rounded[250])
+        self.assertTrue(small.exact is not None)
+
+        # then constant size, off by about error in rank, also when merged
+        first = QuantileSketch(0.01, exact_size=1000)
+        for start in range(0, 50000, 5000):
+            first.update(x[start:start + 5000])
+        self.assertTrue(first.exact is None)
+        merged = first.merge(QuantileSketch(0.01, exact_size=1000).update(x[50000:]))
+        self.assertEqual(merged.count, 100000)
+        self.assertTrue(len(merged.means) <= 200)
+        for q in (0.25, 0.5, 0.75):
+            rank = np.searchsorted(values, merged.value_above(q * 100001)) / 100000.0
+            self.assertTrue(abs(rank - q) < 0.01)
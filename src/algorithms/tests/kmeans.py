@@ -3,7 +3,9 @@ from algorithms import kmeans
 import os
 import os.path
 import shutil
+import random
 from numpy.random import seed
+import numpy as np
 
 
 class KMeansTests(TestCase):
@@ -31,3 +33,283 @@ class KMeansTests(TestCase):
 
         self.assertEqual(bestK, 5)
         self.assertEqual(round(bestRatio, 8), round(169.55817157830558, 8))
+
+    def test_memory_mode_matches_csv_mode(self):
+        testDir = 'kmeans_memory_test'
+        if not os.path.exists(testDir):
+            os.makedirs(testDir)
+
+        kMax = 6
+        iFileName = testDir + '/gauss_5_groups.csv'
+        uKMeans = kmeans.UnsupervisedKMeans(testDir + '/tmp')
+
+        seed(2013)
+        uKMeans.writeData(uKMeans.generateGaussData(), iFileName)
+
+        results = {}
+        for mode in ['csv', 'memory']:
+            random.seed(2013)
+            results[mode] = uKMeans.run(kMax, iFileName, testDir + '/' + mode, mode)
+
+        groupings = []
+        for k in range(2, kMax + 1):
+            groupings.append([open(testDir + '/' + mode + '/k' + str(k)).read()
+                              for mode in ['csv', 'memory']])
+
+        if os.path.exists(testDir):
+            shutil.rmtree(testDir)
+
+        self.assertEqual(results['csv'][0], results['memory'][0])
+        self.assertAlmostEqual(results['csv'][1], results['memory'][1], 8)
+        for csvGrouping, memoryGrouping in groupings:
+            self.assertEqual(csvGrouping, memoryGrouping)
+
+    def test_minibatch_grouping(self):
+        seed(2013)
+        random.seed(2013)
+        testDir = 'kmeans_minibatch_test'
+        if not os.path.exists(testDir):
+            os.makedirs(testDir)
+
+        iFileName = testDir + '/gauss_5_groups.csv'
+        oDir = testDir + '/res'
+        uKMeans = kmeans.UnsupervisedKMeans(testDir + '/tmp')
+        uKMeans.batchSize = 64
+
+        uKMeans.writeData(uKMeans.generateGaussData(), iFileName)
+        bestK, bestRatio = uKMeans.run(8, iFileName, oDir, mode='minibatch')
+        rows = [line for line in open(oDir + '/k' + str(bestK))]
+
+        if os.path.exists(testDir):
+            shutil.rmtree(testDir)
+
+        self.assertEqual(bestK, 5)
+        self.assertEqual(len(rows), 500)
+
+    def test_bounds_skip_distances_without_changing_groups(self):
+        testDir = 'kmeans_bounds_test'
+        if not os.path.exists(testDir):
+            os.makedirs(testDir)
+
+        kMax = 8
+        iFileName = testDir + '/gauss_5_groups.csv'
+        uKMeans = kmeans.UnsupervisedKMeans(testDir + '/tmp')
+
+        seed(2013)
+        uKMeans.writeData(uKMeans.generateGaussData(), iFileName)
+
+        results = {}
+        for useBounds in [False, True]:
+            random.seed(2013)
+            uKMeans.useBounds = useBounds
+            results[useBounds] = uKMeans.run(kMax, iFileName, testDir + '/' + str(useBounds), 'memory')
+
+        groupings = []
+        for k in range(2, kMax + 1):
+            groupings.append([open(testDir + '/' + str(useBounds) + '/k' + str(k)).read()
+                              for useBounds in [False, True]])
+
+        if os.path.exists(testDir):
+            shutil.rmtree(testDir)
+
+        self.assertEqual(results[False][0], results[True][0])
+        self.assertAlmostEqual(results[False][1], results[True][1], 8)
+        for fullGrouping, boundedGrouping in groupings:
+            self.assertEqual(fullGrouping, boundedGrouping)
+        self.assertTrue(uKMeans.skippedDistances > uKMeans.computedDistances)
+
+    def test_bounds_with_empty_group(self):
+        rng = np.random.RandomState(3)
+        X = np.vstack([rng.normal(0, 1, (200, 2)), rng.normal(10, 1, (200, 2))])
+        uKMeans = kmeans.UnsupervisedKMeans()
+        for emptyCls in [2, 0]:
+            # the groups start mixed, so vectors move in the later passes
+            labels = np.array([1, 2] if emptyCls == 0 else [0, 1])[rng.randint(0, 2, X.shape[0])]
+            results = {}
+            for useBounds in [False, True]:
+                uKMeans.useBounds = useBounds
+                means, groups, inter, intra = uKMeans.groupMatrix(3, X, labels.copy())[:4]
+                results[useBounds] = (np.bincount(groups, minlength=3), intra)
+            self.assertEqual(results[False][0][emptyCls], 0)
+            self.assertEqual(sorted(results[False][0]), [0, 200, 200])
+            self.assertEqual(list(results[False][0]), list(results[True][0]))
+            self.assertAlmostEqual(results[False][1], results[True][1], 8)
+
+    def test_seeded_restarts_are_reproducible(self):
+        testDir = 'kmeans_restarts_test'
+        if not os.path.exists(testDir):
+            os.makedirs(testDir)
+
+        kMax = 7
+        iFileName = testDir + '/gauss_5_groups.csv'
+        uKMeans = kmeans.UnsupervisedKMeans(testDir + '/tmp')
+        uKMeans.init = 'k-means++'
+        uKMeans.nInit = 3
+        uKMeans.nWorkers = 2
+        uKMeans.seed = 2013
+
+        seed(2013)
+        uKMeans.writeData(uKMeans.generateGaussData(), iFileName)
+
+        results = []
+        for run in range(2):
+            oDir = testDir + '/res' + str(run)
+            bestK, bestRatio = uKMeans.run(kMax, iFileName, oDir, 'memory')
+            results.append((bestK, bestRatio, open(oDir + '/k' + str(bestK)).read()))
+
+        if os.path.exists(testDir):
+            shutil.rmtree(testDir)
+
+        self.assertEqual(results[0][0], 5)
+        self.assertEqual(results[0], results[1])
+
+    def test_local_split_grouping(self):
+        seed(2013)
+        random.seed(2013)
+        testDir = 'kmeans_local_split_test'
+        if not os.path.exists(testDir):
+            os.makedirs(testDir)
+
+        iFileName = testDir + '/gauss_5_groups.csv'
+        uKMeans = kmeans.UnsupervisedKMeans(testDir + '/tmp')
+        uKMeans.writeData(uKMeans.generateGaussData(), iFileName)
+
+        results = {}
+        for localSplit in [False, True]:
+            random.seed(2013)
+            uKMeans.localSplit = localSplit
+            results[localSplit] = uKMeans.run(10, iFileName, testDir + '/res', 'memory')
+
+        if os.path.exists(testDir):
+            shutil.rmtree(testDir)
+
+        self.assertEqual(results[True][0], 5)
+        self.assertEqual(results[True][0], results[False][0])
+        self.assertTrue(abs(results[True][1] - results[False][1]) < 0.001 * results[False][1])
+
+    def test_memmap_mode_matches_memory_mode(self):
+        testDir = 'kmeans_memmap_test'
+        if not os.path.exists(testDir):
+            os.makedirs(testDir)
+
+        kMax = 6
+        iFileName = testDir + '/gauss_5_groups.csv'
+        uKMeans = kmeans.UnsupervisedKMeans(testDir + '/tmp')
+        uKMeans.batchSize = 128
+
+        seed(2013)
+        uKMeans.writeData(uKMeans.generateGaussData(), iFileName)
+
+        # the sweep updates an int32 class array, mapped from tmpDir in memmap mode
+        sweptLabels = {}
+        def recordingSweepMatrix(maxK, X, labels, *args):
+            sweptLabels[type(labels)] = labels.dtype
+            return kmeans.UnsupervisedKMeans.sweepMatrix(uKMeans, maxK, X, labels, *args)
+        uKMeans.sweepMatrix = recordingSweepMatrix
+
+        results = {}
+        for mode in ['memory', 'memmap']:
+            random.seed(2013)
+            results[mode] = uKMeans.run(kMax, iFileName, testDir + '/' + mode, mode)
+        tmpDirRemoved = not os.path.exists(testDir + '/tmp')
+
+        open(testDir + '/empty.csv', 'w').close()
+        self.assertRaises(ValueError, uKMeans.run, kMax, testDir + '/empty.csv', testDir + '/empty', 'memmap')
+
+        groupings = []
+        for k in range(2, kMax + 1):
+            groupings.append([open(testDir + '/' + mode + '/k' + str(k)).read()
+                              for mode in ['memory', 'memmap']])
+
+        if os.path.exists(testDir):
+            shutil.rmtree(testDir)
+
+        self.assertEqual(results['memory'], results['memmap'])
+        self.assertEqual({np.ndarray: np.int32, np.memmap: np.int32}, sweptLabels)
+        self.assertTrue(tmpDirRemoved)
+        for memoryGrouping, memmapGrouping in groupings:
+            self.assertEqual(memoryGrouping, memmapGrouping)
+
+    def test_partial_fit_appends_new_vectors(self):
+        seed(2013)
+        random.seed(2013)
+        testDir = 'kmeans_partial_fit_test'
+        if not os.path.exists(testDir):
+            os.makedirs(testDir)
+
+        iFileName = testDir + '/gauss_5_groups.csv'
+        newFileName = testDir + '/gauss_5_groups_new.csv'
+        oDir = testDir + '/res'
+        uKMeans = kmeans.UnsupervisedKMeans(testDir + '/tmp')
+
+        X = uKMeans.generateGaussData()
+        uKMeans.writeData(X, iFileName)
+        bestK, bestRatio = uKMeans.run(6, iFileName, oDir, 'memory')
+        fullMeans = uKMeans.loadModel(oDir + '/k5.model').means()
+
+        Y = uKMeans.generateGaussData()
+        uKMeans.writeData([y[:10] for y in Y], newFileName)
+        means = uKMeans.partialFit(5, newFileName, oDir, passes=2)
+        model = uKMeans.loadModel(oDir + '/k5.model')
+        rows = [line for line in open(oDir + '/k5')]
+
+        if os.path.exists(testDir):
+            shutil.rmtree(testDir)
+
+        self.assertEqual(bestK, 5)
+        self.assertEqual(len(rows), 550)
+        self.assertEqual(model.counts.sum(), 550)
+        self.assertTrue(np.allclose(model.means(), means))
+        self.assertTrue(np.abs(np.array(means) - fullMeans).max() < 0.5)
+
+    def test_resume_from_checkpoint(self):
+        testDir = 'kmeans_resume_test'
+        if not os.path.exists(testDir):
+            os.makedirs(testDir)
+
+        kMax = 7
+        iFileName = testDir + '/gauss_5_groups.csv'
+        uKMeans = kmeans.UnsupervisedKMeans(testDir + '/tmp')
+        seed(2013)
+        uKMeans.writeData(uKMeans.generateGaussData(), iFileName)
+
+        class Interrupted(Exception):
+            pass
+
+        def interruptedChooseSplitClass(k, sig):
+            if k == 5:
+                raise Interrupted()
+            return kmeans.UnsupervisedKMeans.chooseSplitClass(uKMeans, k, sig)
+
+        results = {}
+        for mode in ['csv', 'memory', 'minibatch']:
+            random.seed(2013)
+            expected = uKMeans.run(kMax, iFileName, testDir + '/full', mode)
+
+            random.seed(2013)
+            uKMeans.chooseSplitClass = interruptedChooseSplitClass
+            self.assertRaises(Interrupted, uKMeans.run, kMax, iFileName, testDir + '/resumed', mode)
+            del uKMeans.chooseSplitClass
+            checkpointed = os.path.exists(testDir + '/resumed/kmeans.checkpoint')
+            resumed = uKMeans.run(kMax, iFileName, testDir + '/resumed', mode, resume=True)
+
+            results[mode] = (expected, resumed, checkpointed,
+                             open(testDir + '/full/k' + str(kMax)).read(),
+                             open(testDir + '/resumed/k' + str(kMax)).read(),
+                             os.path.exists(testDir + '/resumed/kmeans.checkpoint'))
+
+        if os.path.exists(testDir):
+            shutil.rmtree(testDir)
+
+        for mode in results:
+            expected, resumed, checkpointed, expectedGrouping, resumedGrouping, leftOver = results[mode]
+            self.assertTrue(checkpointed)
+            self.assertFalse(leftOver)
+            self.assertEqual(expected[0], resumed[0])
+            self.assertAlmostEqual(expected[1], resumed[1], 8)
+            self.assertEqual(expectedGrouping, resumedGrouping)
+
+        # restarts are not checkpointed
+        uKMeans.nInit = 2
+        self.assertRaises(ValueError, uKMeans.run, kMax, iFileName, testDir + '/restarts', 'memory', True)
+        self.assertFalse(os.path.exists(testDir + '/restarts'))
@@ -8,11 +8,13 @@ from unittest import TestCase
 from algorithms.tests import TEST_FILE_PATH
 from algorithms.preprocess import get_types, fill_missing_values
 from algorithms.preprocess import transpose
+from algorithms.arff_data import read_header, data_rows
 from algorithms.preprocess import divide
 from algorithms.preprocess import normalise
 from algorithms.preprocess import filter
 from random import seed
 from math import fabs
+import numpy as np
 
 
 class CleanTests(TestCase):
@@ -73,6 +75,36 @@ class TransposeTests(TestCase):
                 self.assertTrue('0' in attr_list[-3:][(line_nr + 1) % 3])
                 self.assertTrue('0' in attr_list[-3:][(line_nr + 2) % 3])
 
+    def test_sparse_transpose(self):
+        source = join(TEST_FILE_PATH, u'pauksciai.csv')
+        dense = join(TEST_FILE_PATH, 'tmp', u'pauksciai_transposed.csv')
+        sparse = join(TEST_FILE_PATH, 'tmp', u'pauksciai_transposed.arff')
+        transpose(source, output=dense, attr=1)
+        transpose(source, output=sparse, attr=1, sparse=True)
+
+        with open(sparse) as sparse_file:
+            header = read_header(sparse_file)
+            sparse_rows = [[value.strip() for value in row] for row in data_rows(sparse_file, header)]
+        with open(dense) as dense_file:
+            dense_rows = [[value.strip() for value in row] for row in csv.reader(dense_file)]
+        self.assertEqual(sparse_rows, dense_rows)
+        self.assertEqual(len([line for line in header if line.startswith('@attribute')]), 10)
+        self.assertTrue('@attribute attr1=strutis numeric\n' in header)
+
+    def test_sparse_transpose_quoted_values(self):
+        source = join(TEST_FILE_PATH, 'tmp', 'quoted.csv')
+        sparse = join(TEST_FILE_PATH, 'tmp', 'quoted_transposed.arff')
+        rows = [['1', 'a', 'x, y'], ['2', 'b', "it's"], ['3', 'a', 'say "hi"'], ['4', 'b', 'back\\slash {}']]
+        with open(source, 'w') as source_file:
+            csv.writer(source_file).writerows(rows)
+        transpose(source, output=sparse, attr=1, sparse=True)
+
+        with open(sparse) as sparse_file:
+            header = read_header(sparse_file)
+            sparse_rows = list(data_rows(sparse_file, header))
+        self.assertEqual(sparse_rows, [[row[0]] + (['1', '0'] if row[1] == 'a' else ['0', '1']) + [row[2]]
+                                       for row in rows])
+
 
 class TransformTests(TestCase):
     def test_z_normalisation(self):
@@ -88,6 +120,27 @@ class TransformTests(TestCase):
                 self.assertTrue(float(attr_list[attr]) < 4.5)
                 self.assertTrue(float(attr_list[attr]) > -4.5)
 
+    def test_normalise_attributes_in_one_pass(self):
+        source = join(TEST_FILE_PATH, u'pauksciai.csv')
+        step = join(TEST_FILE_PATH, 'tmp', u'pauksciai_z_norm_2.csv')
+        single = join(TEST_FILE_PATH, 'tmp', u'pauksciai_z_norm_2_3.csv')
+        output = join(TEST_FILE_PATH, 'tmp', u'pauksciai_z_norm_all.csv')
+
+        normalise(source, step, 2)
+        normalise(step, single, 3)
+        normalise(source, output, [2, 3])
+        self.assertEqual(open(single).read(), open(output).read())
+
+        # every numeric column (not names, dates) at once
+        normalise(source, output, 'numeric')
+        with open(output) as output_file:
+            rows = list(csv.reader(output_file))
+        for attr in (0, 2, 3, 5):
+            column = [float(attr_list[attr]) for attr_list in rows]
+            self.assertAlmostEqual(sum(column), 0)
+            self.assertAlmostEqual(sum(value ** 2 for value in column), len(rows))
+        self.assertEqual(rows[0][1], '  balandis')
+
 
 class FilteringTests(TestCase):
     def test_z_filter(self):
@@ -103,6 +156,14 @@ class FilteringTests(TestCase):
                 # Assert only strutis yra
                 self.assertTrue(fabs(float(attr_list[attr])) > 3)
 
+        # rows outlying in any of the attributes, or in all of them
+        filter(source, output, [2, 3], filter='outliers', update_value=True)
+        with open(output) as output_file:
+            self.assertEqual(len(list(csv.reader(output_file))), 1)
+        filter(source, output, [2, 3], filter='inliers', update_value=True, combine='all')
+        with open(output) as output_file:
+            self.assertEqual(len(list(csv.reader(output_file))), 12)
+
     def test_quartile_filter(self):
         # Selected attr is normalised using quartile transformation and filtered
         source = join(TEST_FILE_PATH, u'pauksciai.csv')
@@ -116,6 +177,34 @@ class FilteringTests(TestCase):
             for attr_list in csv.reader(output_file):
                 self.assertTrue('strutis' in attr_list[1])
 
+    def test_quartile_filter_is_exact_by_default(self):
+        # fewer distinct values than the sketch counts exactly
+        source = join(TEST_FILE_PATH, 'tmp', 'lognormal.csv')
+        output = join(TEST_FILE_PATH, 'tmp', 'lognormal_quartil.csv')
+        values = np.random.RandomState(2013).lognormal(size=50001)
+        np.savetxt(source, values[:, np.newaxis], delimiter=',', fmt='%r')
+
+        ordered = np.sort(values)
+        Q1, Q2 = ordered[int(0.25 * 50002)], ordered[int(0.75 * 50002)]
+        outliers = (values <= Q1 - 1.5 * (Q2 - Q1)) | (values >= Q2 + 1.5 * (Q2 - Q1))
+
+        filter(source, output, 0, filter='outliers', method='quartil')
+        with open(output) as output_file:
+            written = [float(row[0]) for row in csv.reader(output_file)]
+        self.assertEqual(written, list(values[outliers]))
+
+    def test_quartile_filter_skips_constant_columns(self):
+        source = join(TEST_FILE_PATH, 'tmp', 'constant_column.csv')
+        single = join(TEST_FILE_PATH, 'tmp', 'constant_column_0.csv')
+        output = join(TEST_FILE_PATH, 'tmp', 'constant_column_numeric.csv')
+        values = np.random.RandomState(2013).lognormal(size=1000)
+        np.savetxt(source, np.column_stack([values, np.ones(1000)]), delimiter=',', fmt='%r')
+
+        filter(source, single, 0, filter='outliers', method='quartil')
+        filter(source, output, 'numeric', filter='outliers', method='quartil')
+        self.assertTrue(0 < len(open(output).readlines()) < 1000)
+        self.assertEqual(open(single).read(), open(output).read())
+
 
 class DivideFileIntoShardsTests(TestCase):
     def line_count(self, filename, i=0):
@@ -7,32 +7,66 @@ from django.utils.translation import ugettext as _
 
 from damis.models import Experiment, Connection, ParameterValue
 from damis.settings import BUILDOUT_DIR
+from algorithms.arff_data import data_rows
 from algorithms.preprocess import transpose
-from algorithms.statistics import statistics
+from algorithms.statistics import statistics, grouped_statistics
+from algorithms.c45.c45 import learnAndClassify
 
 
-def stat_primitives_service(X, arff=False, *args, **kwargs):
+def stat_primitives_service(X, arff=False, error=None, classColumn=None, *args, **kwargs):
+    '''Medians of columns with more than 100000 distinct values are off by
+    about error (0.001 by default) in rank and computed in constant memory,
+    error 0 makes them exact. With classColumn the statistics are
+    computed for every value of that column.'''
     start_time = datetime.now()
     X_absolute = BUILDOUT_DIR + '/var/www' + X
     Y = '%s_stats%s' % splitext(X)
     Y_absolute = BUILDOUT_DIR + '/var/www' + Y
     if X.endswith('arff'):
         arff = True
-    statistics(X_absolute, Y_absolute, arff=arff)
+    if classColumn not in (None, ''):
+        grouped_statistics(X_absolute, Y_absolute, int(classColumn), arff=arff)
+    else:
+        error = 0.001 if error in (None, '') else float(error) or None
+        statistics(X_absolute, Y_absolute, arff=arff, error=error)
     duration = datetime.now() - start_time
     return [('Y', Y), ('calcTime', duration)]
 
-def transpose_data_service(X, c, arff=False, *args, **kwargs):
+def transpose_data_service(X, c, arff=False, sparse=False, *args, **kwargs):
+    '''With sparse the result is a sparse ARFF file.'''
     start_time = datetime.now()
     X_absolute = BUILDOUT_DIR + '/var/www' + X
-    Y = '%s_transposed%s' % splitext(X)
+    sparse = str(sparse).lower() in ('true', '1', 'on')
+    Y = '%s_transposed%s' % (splitext(X)[0], '.arff' if sparse else splitext(X)[1])
     Y_absolute = BUILDOUT_DIR + '/var/www' + Y
     if X.endswith('arff'):
         arff = True
-    transpose(X_absolute, Y_absolute, int(c), arff=arff)
+    transpose(X_absolute, Y_absolute, int(c), arff=arff, sparse=sparse)
     duration = datetime.now() - start_time
     return [('Y', Y), ('calcTime', duration)]
 
+def c45_service(X, q, Dl, Dt, bins=0, trees=1, arff=False, p=None, *args, **kwargs):
+    '''Dl and Dt are percentages of the data set used for learning and
+    testing; with 2 to 256 bins splits are searched among quantile bins,
+    with 0 among all values; with trees > 1 a bagged ensemble votes. Trees
+    are constructed by p processes.'''
+    bins = int(bins or 0)
+    if bins and not 2 <= bins <= 256:
+        raise ValueError(_('The number of histogram bins must be from 2 to 256, or 0 for exact search'))
+    start_time = datetime.now()
+    X_absolute = BUILDOUT_DIR + '/var/www' + X
+    Y = '%s_c45%s' % splitext(X)
+    Y_absolute = BUILDOUT_DIR + '/var/www' + Y
+    if X.endswith('arff'):
+        arff = True
+    error = learnAndClassify(X_absolute, Y_absolute, Q=float(q),
+                             learnPart=int(float(Dl)), testPart=int(float(Dt)),
+                             bins=bins, arff=arff,
+                             nWorkers=int(p) if p else None,
+                             nTrees=int(trees or 1))
+    duration = datetime.now() - start_time
+    return [('Y', Y), ('calcTime', duration), ('algorithmError', error)]
+
 def not_implemented(*args, **kwargs):
     raise ValueError(_('This service is not implemented yet'))
 
@@ -60,7 +94,9 @@ def select_features_service(X, columns, classColumn, *args, **kwargs):
 
     attr = -1
     new_attr = -1
+    header = []
     for line in input_file:
+        header.append(line)
         if '@attribute' in line.lower():
             attr += 1
             if attr in columns:
@@ -75,7 +111,7 @@ def select_features_service(X, columns, classColumn, *args, **kwargs):
         if line.strip().lower().startswith("@data"):
             break
 
-    for attr_list in csv.reader(input_file):
+    for attr_list in data_rows(input_file, header):
         attrs_to_write = []
         for c in columns:
             attrs_to_write.append(attr_list[c])
@@ -106,7 +142,7 @@ SERVICES = {
     "SELECT FEATURES": select_features_service,
     "STAT PRIMITIVES": stat_primitives_service,
     "MLP": not_implemented,
-    "C45": not_implemented,
+    "C45": c45_service,
     "KMEANS": not_implemented,
     "PCA": not_implemented,
     "SMACOF": not_implemented,